@@ -1,13 +1,24 @@
+import os
+from logger import log
+
 class Defaults:
     applicationId = "d89443d2-327c-4a6f-89e5-496bbb0317db"
     agent = "Dexcom Share/3.0.2.11 CFNetwork/711.2.23 Darwin/14.0.0"
-    login_url = "https://share1.dexcom.com/ShareWebServices/Services/" +\
-        "General/LoginPublisherAccountByName"
+    #Base URLs can be overridden (e.g. to point at cgm_emulator.py) with these environment variables
+    dexcom_share_url = os.getenv("DEXCOM_SHARE_URL", "https://share1.dexcom.com/ShareWebServices/Services").rstrip("/")
+    sugarmate_url = os.getenv("SUGARMATE_URL", "https://sugarmate.io/api/v1").rstrip("/")
+    login_url = dexcom_share_url + "/General/LoginPublisherAccountByName"
     accept = 'application/json'
     content_type = 'application/json'
-    LatestGlucose_url = "https://share1.dexcom.com/ShareWebServices/" +\
-        "Services/Publisher/ReadPublisherLatestGlucoseValues"
+    LatestGlucose_url = dexcom_share_url + "/Publisher/ReadPublisherLatestGlucoseValues"
     sessionID = None
+    #HTTP keep-alive pool settings shared by all backends
+    connect_timeout = 3.05 # Seconds
+    read_timeout = 15 # Seconds
+    pool_maxsize = 2
+    #Dexcom session IDs are cached on disk and refreshed ahead of expiry
+    session_ttl = 8 * 60 * 60 # Seconds
+    session_refresh_margin = 30 * 60 # Seconds
     MIN_PASSPHRASE_LENGTH = 12
     last_seen = 0
     # Mapping friendly names to trend IDs from dexcom
@@ -57,6 +68,17 @@ class Defaults:
     Linux_font = "dejavusans"
     Mac_font = "arialunicode"
 
+    @classmethod
+    def use_dexcom_share_url(cls, base_url):
+        """ Point the Dexcom Share login and fetch URLs at another server """
+        cls.dexcom_share_url = base_url.rstrip("/")
+        cls.login_url = cls.dexcom_share_url + "/General/LoginPublisherAccountByName"
+        cls.LatestGlucose_url = cls.dexcom_share_url + "/Publisher/ReadPublisherLatestGlucoseValues"
+
+    @classmethod
+    def sugarmate_latest_url(cls, api_key):
+        return cls.sugarmate_url + "/" + api_key + "/latest.json"
+
 
 class Error(Exception):
     """Base class for exceptions in this module."""
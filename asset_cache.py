@@ -0,0 +1,82 @@
+"""Image asset caching for the pygame displays.
+
+``pygame.image.load`` reads and decodes the file, and blitting an unconverted
+surface converts its pixels on every blit; ``smoothscale`` is slower still.
+Here each image is loaded once, converted to the display's pixel format
+(``convert_alpha`` when it has per-pixel alpha, ``convert`` otherwise) and
+every scaled variant is kept by (path, size). File mtimes are checked at most
+every ``check_interval`` seconds, and a changed file is reloaded.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from typing import Any, Optional
+
+
+class AssetCache:
+    def __init__(self, pygame: Any, *, check_interval: float = 5.0) -> None:
+        self._pygame = pygame
+        self._check_interval = check_interval
+        # path -> (mtime, when it was last checked)
+        self._mtimes: dict[str, tuple[float, float]] = {}
+        self._surfaces: dict[tuple[str, Optional[tuple[int, int]]], Any] = {}
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+
+    def _check(self, path: str) -> None:
+        """Forget every variant of ``path`` if the file changed since it was loaded."""
+
+        now = time.monotonic()
+        known = self._mtimes.get(path)
+        if known is not None and now - known[1] < self._check_interval:
+            return
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            mtime = -1.0
+        if known is not None and known[0] != mtime:
+            self.reloads += 1
+            for key in [key for key in self._surfaces if key[0] == path]:
+                del self._surfaces[key]
+        self._mtimes[path] = (mtime, now)
+
+    def load(self, path: str, size: Optional[tuple[int, int]] = None) -> Any:
+        """The image at ``path`` in display format, smoothscaled to ``size`` if given.
+
+        Cached surfaces are shared; callers must blit them, not draw onto them.
+        """
+
+        self._check(path)
+        key = (path, tuple(size) if size else None)
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        if key[1] is None:
+            pygame = self._pygame
+            surface = pygame.image.load(path)
+            if surface.get_flags() & pygame.SRCALPHA:
+                surface = surface.convert_alpha()
+            else:
+                surface = surface.convert()
+        else:
+            surface = self._pygame.transform.smoothscale(self.load(path), key[1])
+        self._surfaces[key] = surface
+        return surface
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "surfaces": len(self._surfaces),
+        }
+
+    def clear(self) -> None:
+        self._surfaces.clear()
+        self._mtimes.clear()
@@ -0,0 +1,69 @@
+"""Micro-benchmark: cost of decoding and normalizing one response per source.
+
+Run from the repository root:  python benchmarks/parse_benchmark.py
+Reports microseconds per response for the stdlib decoder and, when installed,
+the fast decoder normalize.py picked.
+"""
+
+import json
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import normalize  # noqa: E402
+
+
+class _Response:
+    """Just enough of requests.Response for normalize.decode."""
+
+    def __init__(self, body):
+        self.content = body
+
+
+def _payloads(count=288):
+    now_ms = int(time.time()) * 1000
+    dexcom = [
+        {"WT": f"Date({now_ms - i * 300000})", "ST": f"Date({now_ms - i * 300000})",
+         "DT": f"Date({now_ms - i * 300000}-0500)", "Value": 100 + i % 50, "Trend": "Flat"}
+        for i in range(count)
+    ]
+    nightscout = [
+        {"_id": f"{i:024x}", "device": "share2", "date": now_ms - i * 300000,
+         "dateString": "2024-01-01T00:00:00.000Z", "sgv": 100 + i % 50, "delta": 1.5,
+         "direction": "Flat", "type": "sgv", "utcOffset": 0}
+        for i in range(count)
+    ]
+    sugarmate = {"time": "12:00", "value": 112, "trend_words": "FLAT", "trend_symbol": "→",
+                 "delta": 2, "timestamp": "2024-01-01T12:00:00-05:00", "x": now_ms // 1000,
+                 "reading": "112 → +2"}
+    return {
+        f"dexcom x{count}": (json.dumps(dexcom).encode(), normalize.dexcom_readings),
+        "dexcom x1": (json.dumps(dexcom[:1]).encode(), normalize.dexcom_readings),
+        f"nightscout x{count}": (json.dumps(nightscout).encode(), normalize.nightscout_readings),
+        "nightscout x1": (json.dumps(nightscout[:1]).encode(), normalize.nightscout_readings),
+        "sugarmate": (json.dumps(sugarmate).encode(), normalize.sugarmate_reading),
+    }
+
+
+def _time(loads, body, parse, number):
+    response = _Response(body)
+    return min(timeit.repeat(lambda: parse(loads(response.content)), number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    decoders = {"json": json.loads}
+    if normalize.DECODER != "json":
+        decoders[normalize.DECODER] = normalize.loads
+
+    print(f"{'source':<18}" + "".join(f"{name + ' (us)':>16}" for name in decoders))
+    for source, (body, parse) in _payloads().items():
+        number = 200 if "x1" not in source and source != "sugarmate" else 20000
+        row = "".join(f"{_time(loads, body, parse, number):>16.1f}" for loads in decoders.values())
+        print(f"{source:<18}{row}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""Benchmark suite driven by recorded upstream responses.
+
+Run from anywhere:  python benchmarks/run_benchmarks.py [--output results.json]
+
+Measures, using the responses in benchmarks/fixtures:
+  * parse time for Dexcom Share, Nightscout (entries/sgv, devicestatus) and Sugarmate
+  * PygameDisplay.render and render_connection_error on an offscreen SDL surface
+  * RGB565 framebuffer writes (into a plain file standing in for /dev/fb1)
+  * poll-to-frame latency: Nightscout fetch from a local server through to a rendered frame
+
+Results are written as JSON (with the commit and hardware they came from) so
+runs can be compared across commits and across Pi models.
+"""
+
+import argparse
+import datetime
+import http.server
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+sys.path.insert(0, REPO_DIR)
+
+# Render offscreen; must be set before pygame initializes a video driver.
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import normalize  # noqa: E402
+from logger import log  # noqa: E402
+
+
+def _fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+        return f.read()
+
+
+class _Response:
+    """Just enough of requests.Response for normalize.decode."""
+
+    def __init__(self, body):
+        self.content = body
+
+
+def _summary(samples):
+    """Timing summary in milliseconds."""
+
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1e3,
+        "median_ms": statistics.median(ordered) * 1e3,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1e3,
+        "min_ms": ordered[0] * 1e3,
+        "max_ms": ordered[-1] * 1e3,
+    }
+
+
+def _measure(func, iterations, warmup=3):
+    for _ in range(warmup):
+        func()
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - start)
+    return _summary(samples)
+
+
+def bench_parse(iterations):
+    sources = {
+        "parse.dexcom": ("dexcom_latest_glucose_values.json", normalize.dexcom_readings),
+        "parse.nightscout_entries": ("nightscout_entries_sgv.json", normalize.nightscout_readings),
+        "parse.nightscout_devicestatus": ("nightscout_devicestatus.json", normalize.loop_epoch),
+        "parse.sugarmate": ("sugarmate_latest.json", normalize.sugarmate_reading),
+    }
+    results = {}
+    for name, (fixture, parse) in sources.items():
+        response = _Response(_fixture(fixture))
+        results[name] = _measure(lambda i=0: parse(normalize.decode(response)), iterations)
+    return results
+
+
+def _series():
+    from readings import ReadingSeries
+
+    series = ReadingSeries(288)
+    series.extend(normalize.nightscout_readings(normalize.decode(_Response(_fixture("nightscout_entries_sgv.json")))))
+    return series
+
+
+def bench_render(display, iterations):
+    series = _series()
+    results = {}
+
+    def changed(i=0):
+        # A different "time ago" each frame so nothing is skipped as unchanged.
+        display.render(
+            difference=f"{i % 60} Minutes Ago",
+            reading="123→",
+            change=f"+{i % 9}",
+            loop_image_path=None,
+            connection_ok=True,
+            history=series,
+        )
+
+    def unchanged(i=0):
+        display.render(
+            difference="5 Minutes Ago",
+            reading="123→",
+            change="+2",
+            loop_image_path=None,
+            connection_ok=True,
+            history=series,
+        )
+
+    results["render.changed"] = _measure(changed, iterations)
+    results["render.unchanged"] = _measure(unchanged, iterations)
+    results["render_connection_error"] = _measure(
+        lambda i=0: display.render_connection_error(detail=f"HTTPSConnectionPool: Read timed out ({i})"), iterations
+    )
+    return results
+
+
+def bench_framebuffer(iterations):
+    """FramebufferOutput.write into a plain file: every row changed, and only the "time ago" rows changed."""
+
+    import tempfile
+
+    import pygame
+    from framebuffer import FramebufferOutput
+
+    surface = pygame.display.get_surface()
+    width, height = surface.get_size()
+    frames = [surface.copy(), surface.copy()]
+    time_ago = pygame.Rect(0, 0, width, 40)
+    frames[1].fill((255, 255, 255), time_ago)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        framebuffer = FramebufferOutput(os.path.join(tmp, "fb"), (width, height))
+
+        def full(i=0):
+            surface.fill((i % 256, 0, 255 - i % 256))
+            framebuffer.write(pygame, surface)
+
+        def time_ago_rows(i=0):
+            # As PygameDisplay does it: only the dirty rect's rows are converted and compared.
+            surface.blit(frames[i % 2], (0, 0))
+            framebuffer.write(pygame, surface, [time_ago])
+
+        results["framebuffer.full"] = _measure(full, iterations)
+        results["framebuffer.time_ago_rows"] = _measure(time_ago_rows, iterations)
+        framebuffer.close()
+    return results
+
+
+class _FixtureHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+    routes = {}
+
+    def do_GET(self):
+        body = self.routes.get(urllib.parse.urlsplit(self.path).path)
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def bench_poll_to_frame(display, iterations):
+    from nightscout_data import Nightscout
+    from nightscout_display import display_reading
+    from trend_analysis import TrendAnalyzer
+
+    _FixtureHandler.routes = {
+        "/api/v1/entries/sgv": _fixture("nightscout_entries_sgv.json"),
+        "/api/v1/devicestatus": _fixture("nightscout_devicestatus.json"),
+    }
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def poll(i=0):
+        # A fresh client each time, so every poll fetches and parses a full day of entries.
+        client = Nightscout(url)
+        readings = client.getReading()
+        loop_epoch = normalize.loop_epoch(client.getDeviceStatus())
+        display_reading(readings, loop_epoch, display=display, connection_ok=bool(i % 2), trends=TrendAnalyzer())
+
+    try:
+        return {"poll_to_frame.nightscout": _measure(poll, iterations)}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _hardware_model():
+    try:
+        with open("/proc/device-tree/model", "r", encoding="utf-8", errors="replace") as f:
+            return f.read().strip("\x00\n ")
+    except OSError:
+        return platform.machine()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the cgm_display benchmarks")
+    parser.add_argument("--iterations", "-n", type=int, default=200, help="Timed iterations per benchmark")
+    parser.add_argument("--only", choices=["parse", "render", "poll"], action="append", help="Run only these groups")
+    parser.add_argument("--output", "-o", help="JSON results file (default: benchmarks/results/<model>-<commit>.json)")
+    args = parser.parse_args()
+    groups = args.only or ["parse", "render", "poll"]
+
+    log.setLevel(logging.WARNING)
+    results = {}
+    if "parse" in groups:
+        results.update(bench_parse(args.iterations * 10))
+    if "render" in groups or "poll" in groups:
+        from pygame_display import PygameDisplay
+
+        display = PygameDisplay(headless=True)
+        if "render" in groups:
+            results.update(bench_render(display, args.iterations))
+            results.update(bench_framebuffer(args.iterations))
+        if "poll" in groups:
+            results.update(bench_poll_to_frame(display, max(1, args.iterations // 4)))
+
+    pygame = sys.modules.get("pygame")
+    commit = _commit()
+    model = _hardware_model()
+    report = {
+        "commit": commit,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "model": model,
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver if pygame else None,
+        "sdl_videodriver": os.environ.get("SDL_VIDEODRIVER"),
+        "json_decoder": normalize.DECODER,
+        "results": results,
+    }
+
+    output = args.output
+    if not output:
+        slug = "".join(c if c.isalnum() else "-" for c in model).strip("-").lower()
+        output = os.path.join(REPO_DIR, "benchmarks", "results", f"{slug}-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    for name, summary in results.items():
+        print(f"{name:<32}{summary['median_ms']:>10.3f} ms median{summary['p95_ms']:>10.3f} ms p95")
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,17 +12,32 @@ class cgm_args:
         add_parsers.add_argument("--nightscoutserver", "-ns", help="Set the base URL for your Nightscout server d.g. https://mynightscout.domain.com")
         add_parsers.add_argument("--logging", "-l", default="INFO", help="Logging level: INFO (Default) or DEBUG")
         add_parsers.add_argument("--polling_interval", default=60, help="Polling interval for getting updates from Sugarmate")
-        add_parsers.add_argument("--time_ago_interval", default=30, help="Polling interval for updating the \"Time Ago\" detail") 
+        add_parsers.add_argument("--time_ago_interval", default=30, help="Unused: the display now repaints exactly when the \"Time Ago\" text changes") 
+        add_parsers.add_argument("--stream", nargs="?", const="", metavar="URL", help="Take live updates over socket.io (polling only while the stream is down), optionally from a different URL")
+        add_parsers.add_argument("--token", help="Nightscout access token for the stream")
+        add_parsers.add_argument("--api_secret", help="Nightscout API secret for the stream")
+        self._add_render_arguments(add_parsers)
 
         # Add Subparser for 'dexcom' command
         add_parsers = subparsers.add_parser("dexcom", help="Dexcom mode - Get Display data from a Dexcom server")
         add_parsers.add_argument("--logging", "-l", default="INFO", help="Logging level: INFO (Default) or DEBUG")
         add_parsers.add_argument("--polling_interval", default=60, help="Polling interval for getting updates from Sugarmate")
-        add_parsers.add_argument("--time_ago_interval", default=30, help="Polling interval for updating the \"Time Ago\" detail")
+        add_parsers.add_argument("--time_ago_interval", default=30, help="Unused: the display now repaints exactly when the \"Time Ago\" text changes")
         add_parsers.add_argument("--username", "-u", help="Dexcom Share User Name")
         add_parsers.add_argument("--password", "-p", help="Dexcom Share Password")
+        add_parsers.add_argument("--dexcom_url", help="Dexcom Share base URL, e.g. a local cgm_emulator.py (Default: share1.dexcom.com or $DEXCOM_SHARE_URL)")
+        self._add_render_arguments(add_parsers)
         self.args = ArgParser.parse_args()
 
+    @staticmethod
+    def _add_render_arguments(parser):
+        parser.add_argument("--headless", action="store_true", help="Render offscreen (SDL dummy driver) instead of to the LCD")
+        parser.add_argument("--frame_dir", help="Write every rendered frame to this directory")
+        parser.add_argument("--frame_format", default="png", choices=["png", "rgb"], help="Exported frame format: png (Default) or raw 24-bit rgb")
+        parser.add_argument("--framebuffer", metavar="PATH", help="Write frames straight to this framebuffer device (e.g. /dev/fb1) or file, as RGB565, instead of through SDL")
+        parser.add_argument("--metrics_port", type=int, help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+        parser.add_argument("--metrics_file", help="Periodically write Prometheus metrics to this file")
+
     @property
     def logging(self):
         return self.args.logging
@@ -45,4 +60,44 @@ class cgm_args:
 
     @property
     def password(self):
-        return self.args.password
\ No newline at end of file
+        return self.args.password
+
+    @property
+    def headless(self):
+        return self.args.headless
+
+    @property
+    def frame_dir(self):
+        return self.args.frame_dir
+
+    @property
+    def frame_format(self):
+        return self.args.frame_format
+
+    @property
+    def framebuffer(self):
+        return self.args.framebuffer
+
+    @property
+    def metrics_port(self):
+        return self.args.metrics_port
+
+    @property
+    def metrics_file(self):
+        return self.args.metrics_file
+
+    @property
+    def dexcom_url(self):
+        return self.args.dexcom_url
+
+    @property
+    def stream(self):
+        return self.args.stream
+
+    @property
+    def token(self):
+        return self.args.token
+
+    @property
+    def api_secret(self):
+        return self.args.api_secret
@@ -1,27 +1,45 @@
 import configparser #Python3 version
 import datetime
+import math
 from logger import log
 import os
 import sys
-import threading
 import platform
 import re
 import time
 import http_general
+import metrics
+import http_session
+import normalize
 from time import sleep
 from Defaults import Defaults, Error, AuthError, FetchError#
 from Defaults import Defaults
 from cgm_args import cgm_args
+from text_cache import TextCache
+from poll_scheduler import ReadingScheduler
+from render_scheduler import RenderScheduler
+from framebuffer import FramebufferOutput
+from pygame_display import save_surface
+from reading_journal import open_journal
+from readings import Reading, ReadingSeries, format_delta
+from trend_analysis import TrendAnalyzer
 
 args = cgm_args()
 
-# On Raspberry Pi with LCD display only
-if  platform.platform().find("arm") >= 0:
+# On Raspberry Pi with LCD display only, or anywhere when rendering headless
+USE_DISPLAY = platform.platform().find("arm") >= 0 or args.headless or args.framebuffer
+FrameCount = 0
+if USE_DISPLAY:
     import pygame
     global pygame, lcd
-    os.putenv('SDL_FBDEV', '/dev/fb1')
+    if args.headless or args.framebuffer:
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    else:
+        os.putenv('SDL_FBDEV', '/dev/fb1')
     pygame.init()
     lcd=pygame.display.set_mode((480, 320))
+    framebuffer=FramebufferOutput(args.framebuffer, lcd.get_size()) if args.framebuffer else None
+    text_cache=TextCache(pygame)
 
 Config = configparser.SafeConfigParser()
 Config.read(os.path.dirname(os.path.realpath(__file__))+"/cgm_display.ini")
@@ -48,17 +66,26 @@ if args.polling_interval:
 else:
     CHECK_INTERVAL = int(Config.get("dexcomshare", "polling_interval"))
 
-if args.time_ago_interval:
-    TIME_AGO_INTERVAL = int(args.time_ago_interval)
-else:
-    TIME_AGO_INTERVAL = int(Config.get("dexcomshare","time_ago_interval"))
+if args.dexcom_url:
+    Defaults.use_dexcom_share_url(args.dexcom_url)
 
 AUTH_RETRY_DELAY_BASE = 2
 FAIL_RETRY_DELAY_BASE = 2
 MAX_AUTHFAILS = Config.get("dexcomshare", "max_auth_fails")
+http_general.MAX_AUTHFAILS = MAX_AUTHFAILS
 MAX_FETCHFAILS = 10
 RETRY_DELAY = 60 # Seconds
 LAST_READING_MAX_LAG = 60 * 7.5
+READING_INTERVAL = 5 * 60 # Seconds between CGM readings
+MAX_BACKFILL = 288 # One day of readings
+
+# Readings we've seen, oldest first.  Filled in by backfill after missed polls.
+History = ReadingSeries(MAX_BACKFILL)
+Journal = None # On-disk copy of History for warm starts, opened in main
+Trends = TrendAnalyzer()
+
+poll_cache = http_session.PollCache()
+LastFrame = None
 
 def isNightTime():
     now = datetime.datetime.now()
@@ -68,35 +95,34 @@ def isNightTime():
         return False
 
 def parse_dexcom_response(ops, res):
-    log.debug(f'Parsing response: {res.json()}')
-    epochtime = int((datetime.datetime.utcnow() - datetime.datetime(1970, 1, 1)).total_seconds())
-    try:
-        last_reading_time = int(re.search('\d+', res.json()[0]['ST']).group())/1000
-        reading_lag = epochtime - last_reading_time
-        trend = res.json()[0]['Trend']
-        mgdl = res.json()[0]['Value']
-        
-        #trend_english = DIRECTIONS.keys()[DIRECTIONS.values().index(trend)] # Python2 version
-        #trend_english=list(Defaults.DIRECTIONS.keys())[list(Defaults.DIRECTIONS.values()).index(trend)] # Python3 version
-        trend_english=Defaults.DIRECTIONS[trend]
-        log.info(f"Last bg: {mgdl}  trending: {trend_english} ({trend})  last reading at: {reading_lag} seconds ago")
-        if reading_lag > LAST_READING_MAX_LAG:
-            log.warning(f"***WARN It has been {int(reading_lag/60)} minutes since DEXCOM got a new measurement")
-            last_reading_lag = True
-        else:
-            last_reading_lag = False
-        return {
-                "bg": mgdl,
-                "trend": trend,
-                "trend_english": trend_english,
-                "reading_lag": reading_lag,
-                "last_reading_time": last_reading_time,
-                "last_reading_lag": last_reading_lag
-                }
-    except IndexError:
-        log.error(f"Caught IndexError: return code:{res.status_code} ... response output below")
+    """ Decode the response once; returns every value in it, newest first """
+    log.debug(f'Parsing response: {res.text}')
+    readings = normalize.dexcom_readings(normalize.decode(res))
+    if not readings:
+        log.error(f"No readings in response: return code:{res.status_code} ... response output below")
         log.error(res.__dict__)
-        return None
+        return []
+    reading = readings[0]
+    reading_lag = reading.age()
+    log.info(f"Last bg: {reading.mgdl}  trending: {reading.direction} ({reading.trend})  last reading at: {reading_lag} seconds ago")
+    if reading_lag > LAST_READING_MAX_LAG:
+        log.warning(f"***WARN It has been {int(reading_lag/60)} minutes since DEXCOM got a new measurement")
+    return readings
+
+def backfill_size():
+    """ How many readings to ask for: one when caught up, enough to cover the gap otherwise """
+    if not History:
+        return 2 # Enough for a real delta on the first poll
+    gap = time.time() - History.newest_epoch()
+    if gap < READING_INTERVAL * 2:
+        return 1
+    return min(MAX_BACKFILL, math.ceil(gap / READING_INTERVAL) + 1)
+
+def history_delta():
+    """ Smoothed change per reading over recent history (not just the two most recent polls) """
+    trend = Trends.update(History)
+    log.debug(f"Trend: {trend.rate} mg/dL/min, 15 min: {trend.projected_15}, 30 min: {trend.projected_30}")
+    return trend.delta
 
 def monitor_dexcom():
     """ Main loop """
@@ -108,24 +134,38 @@ def monitor_dexcom():
     failures = 0
     #log.debug("RUNNING {}, failures: {}".format(runs, failures))
     try:
-        if not opts.sessionID:
-            authfails = 0
-            opts.sessionID = http_general.get_sessionID(opts)
-            log.debug(f"Got auth token {opts.sessionID}")
-        res = http_general.fetch(opts)
+        # Uses the in-memory or on-disk cached session; only logs in when neither is valid
+        opts.sessionID = http_general.get_sessionID(opts)
+        max_count = backfill_size()
+        if max_count > 1:
+            log.info(f"Backfilling up to {max_count} readings from Dexcom")
+        # Always search the whole day: the newest value may be well older than the gap (warm-up, outages)
+        res = http_general.fetch(opts, minutes=1440, max_count=max_count)
+        log.debug(f"Connection stats: {http_session.connection_stats()}")
         if res and res.status_code < 400:
             fetchfails = 0
-            reading = parse_dexcom_response(opts, res)
-            if reading:
+            if poll_cache.unchanged("dexcom", res):
+                log.debug("Dexcom response unchanged since last poll, skipping parse")
+                return poll_cache.value("dexcom")
+            readings = parse_dexcom_response(opts, res)
+            if readings:
+                reading = readings[0]
+                poll_cache.store("dexcom", res, reading)
+                added = History.extend(readings)
+                log.debug(f"Added {added} readings to history ({len(History)} held)")
+                if Journal:
+                    Journal.sync(History)
                 return reading
             else:
+                metrics.fetch_failed("dexcom")
                 opts.sessionID = None
-                log.error("parse_dexcom_response returned None.  Investigate above logs")
+                log.error("parse_dexcom_response returned no readings.  Investigate above logs")
                 if run_once:
                     return None
         else:
             failures += 1
-            opts.sessionID = None
+            if http_general.is_session_error(res):
+                http_general.invalidate_session(opts)
             log.warning(f"Saw an error from the dexcom api, code: {res.status_code}.  details to follow")
             raise opts.FetchError(res.status_code, res)
             log.warning(f"Fetch failed on: {res.status_code}")
@@ -139,27 +179,30 @@ def monitor_dexcom():
             fetchfails += 1
 
     except ConnectionError:
+        metrics.fetch_failed("dexcom")
         opts.sessionID = None
         raise log.warning("Cnnection Error.. sleeping for {} seconds and".format(RETRY_DELAY) + " trying again")
         time.sleep(RETRY_DELAY)
     except AuthError:
+        metrics.fetch_failed("dexcom")
         log.error("Authentication error connecting to Dexcom share")
         return False
     except:
+        metrics.fetch_failed("dexcom")
         log.debug("Caught exception communicating with Dexcom:  Returning False")
         return False
 
     return False
 
 def display_reading(reading, bgdelta):
-    log.debug("Displaying with Reading of " + str(reading) + " and a change of " + '{0:{1}}'.format(bgdelta, '+' if bgdelta else ''))
+    log.debug("Displaying with Reading of " + str(reading) + " and a change of " + format_delta(bgdelta))
     #log.debug("Differeince is " + '{0:{1}}'.format(number, '+' if number else ''))
     # On Raspberry Pi with LCD display only
     thePlatform = platform.platform().lower()
-    if not platform.platform().find("arm") >= 0:
+    if not USE_DISPLAY:
         log.debug("Skipping display.  Not on Raspberry Pi")
         return
-    global pygame, lcd
+    global pygame, lcd, text_cache, FrameCount
     log.debug("Getting ready to display on the LCD panel")
     if thePlatform.find("linux") >= 0:
         fonttouse = Defaults.Linux_font
@@ -168,9 +211,7 @@ def display_reading(reading, bgdelta):
     else:
         fonttouse = ""
 
-    now = datetime.datetime.utcnow()
-    reading_time = datetime.datetime.utcfromtimestamp(reading["last_reading_time"])
-    difference = round((now - reading_time).total_seconds()/60)
+    difference = round(reading.age()/60)
     log.debug(f"Time difference since last good reading is: {difference}")
     if difference == 0:
         str_difference = "Just Now"
@@ -178,83 +219,101 @@ def display_reading(reading, bgdelta):
         str_difference = str(difference) + " Minute Ago"
     else:
         str_difference = str(difference) + " Minutes Ago"
+    global LastFrame
+    frame = (str_difference, reading.mgdl, reading.trend, bgdelta, isNightTime())
+    if frame == LastFrame:
+        log.debug("Nothing visible changed, skipping redraw")
+        return
+    LastFrame = frame
     log.info(f"About to update Time Ago Display with reading from {str_difference}")
-    log.debug(f"About to acquire lock with: {lock}")
-    lock.acquire(blocking=True)
-    log.debug(f"Acquired lock {lock}")
-
-    try:
-        if isNightTime():
-           log.debug("Setting to Nighttime mode")
-           lcd.fill(Defaults.BLACK)
-           font_color=Defaults.GREY
-        else:
-           log.debug("Setting to Daylight mode")
-           lcd.fill(Defaults.BLUE)
-           font_color=Defaults.WHITE
-        
-        font_time = pygame.font.Font(None, 75)
-        text_surface = font_time.render(str_difference, True, font_color)
-        rect = text_surface.get_rect(center=(240,20))
-        lcd.blit(text_surface, rect)
+    started = time.perf_counter()
+    if isNightTime():
+       log.debug("Setting to Nighttime mode")
+       lcd.fill(Defaults.BLACK)
+       font_color=Defaults.GREY
+    else:
+       log.debug("Setting to Daylight mode")
+       lcd.fill(Defaults.BLUE)
+       font_color=Defaults.WHITE
+    
+    text_surface = text_cache.render(str_difference, 75, font_color)
+    rect = text_surface.get_rect(center=(240,20))
+    lcd.blit(text_surface, rect)
 
-        #font_big = pygame.font.SysFont("dejavusans", 200)
-        font_big = pygame.font.SysFont(fonttouse, 200)
-        #trend_index = reading["trend"] - This was causing the line below using trend_index to fail all of a sudden.  Passing trend string instead of the index.  2/6/22
-        trend_index = Defaults.DIRECTIONS[reading['trend']]  ## Added 2/5/22 to fix above problem.  Not sure how if ever worked...
-        if (reading["last_reading_lag"] == True) or (difference > round(LAST_READING_MAX_LAG/60)):
-           str_reading = "---"
+    if (reading.age() > LAST_READING_MAX_LAG) or (difference > round(LAST_READING_MAX_LAG/60)):
+       str_reading = "---"
+    else:
+       str_reading = str(reading.mgdl)+reading.arrow
+    text_surface = text_cache.render(str_reading, 200, font_color, face=fonttouse, sysfont=True)
+    rect = text_surface.get_rect(center=(240,155))
+    lcd.blit(text_surface, rect)
+    
+    text_surface = text_cache.render(format_delta(bgdelta), 135, font_color)
+    rect = text_surface.get_rect(center=(240, 275))
+    lcd.blit(text_surface, rect)
+    
+    with metrics.timed("display_update"):
+        if framebuffer:
+            framebuffer.write(pygame, lcd)
         else:
-           str_reading = str(reading["bg"])+Defaults.ARROWS[str(trend_index)]
-        text_surface = font_big.render(str_reading, True, font_color)
-        rect = text_surface.get_rect(center=(240,155))
-        lcd.blit(text_surface, rect)
-        
-        font_medium = pygame.font.Font(None, 135)
-        text_surface = font_medium.render('{0:{1}}'.format(bgdelta, '+' if bgdelta else ''),True,font_color)
-        rect = text_surface.get_rect(center=(240, 275))
-        lcd.blit(text_surface, rect)
-        
-        pygame.display.update()
-        pygame.mouse.set_visible(False)
-    finally:
-        log.debug(f"About to release lock: {lock}")
-        lock.release()
-        log.debug(f"Lock released: {lock}")
+            pygame.display.update()
+    pygame.mouse.set_visible(False)
+    FrameCount += 1
+    elapsed = time.perf_counter() - started
+    metrics.observe("render", elapsed)
+    log.debug(f"Rendered frame {FrameCount} in {elapsed * 1000:.2f} ms")
+    if args.frame_dir:
+        os.makedirs(args.frame_dir, exist_ok=True)
+        save_surface(pygame, lcd, os.path.join(args.frame_dir, f"frame-{FrameCount:06d}.{args.frame_format}"))
+    log.debug(f"Text cache: {text_cache.stats()}")
    
-def TimeAgoThread():
-    global TheReading, BGDifference
-    #log.debug("Differeince is " + '{0:{1}}'.format(number, '+' if number else ''))
-    while True:
-        display_reading(TheReading, BGDifference)
-        sleep(TIME_AGO_INTERVAL)
-
 if __name__ == '__main__':      
-    lock = threading.RLock()
-    log.debug(f"Created lock: {lock}")
-    
-    LastReading = 0
     BGDifference = 0
     TheReading = False
     
-    TheReading=monitor_dexcom() #One initial reading to have data for the TimeAgo Thread before we get into the main loop
-    i = 1
+    # CHECK_INTERVAL is now the fallback/backoff ceiling; polls follow the reading cadence.
+    scheduler = ReadingScheduler(fallback_interval=CHECK_INTERVAL, max_backoff=CHECK_INTERVAL)
+    # Repaints happen only when the "Time Ago" text (or night mode) changes, not on a fixed tick.
+    renders = RenderScheduler()
+    metrics.start_export(port=args.metrics_port, path=args.metrics_file)
 
-    TimeAgo = threading.Thread(target=TimeAgoThread)
-    TimeAgo.setName("TimeAgoThread")
-    TimeAgo.start()
-    sleep(CHECK_INTERVAL)
+    Journal = open_journal(DEXCOM_ACCOUNT_NAME, History)
+    TheReading = History.latest()
+    if TheReading:
+        # Warm start: paint the last known reading before any network I/O.
+        BGDifference = history_delta()
+        display_reading(TheReading, BGDifference)
+
+    TheReading=monitor_dexcom() or TheReading
+    if TheReading:
+        poll_cache.same_identity("newest", TheReading.identity())
+        BGDifference = history_delta()
+        scheduler.observe(TheReading.epoch)
+    i = 1
 
     while True:
-        i += 1
-        try:
-            LastReading = TheReading["bg"]
-            LastReadingTime = TheReading["last_reading_time"]
-            TheReading=monitor_dexcom()
-            if (TheReading["last_reading_time"] != LastReadingTime):
-                BGDifference = TheReading["bg"] - LastReading
-            log.debug(f"Iteration #{i}-{TheReading}")
-            log.debug(f"Difference of {BGDifference}")
-        except:
-            log.info("Exception processing The Reading, Sleeping and trying again....")
-        sleep(CHECK_INTERVAL)
+        if scheduler.delay() <= 0:
+            i += 1
+            try:
+                reading = monitor_dexcom()
+                if not reading:
+                    # monitor_dexcom already logged and counted the failure; keep showing the last reading.
+                    scheduler.observe(None)
+                    log.info("No reading this poll, keeping the last one and trying again....")
+                else:
+                    TheReading = reading
+                    if not poll_cache.same_identity("newest", TheReading.identity()):
+                        BGDifference = history_delta()
+                        log.debug(f"Iteration #{i}-{TheReading}")
+                        log.debug(f"Difference of {BGDifference}")
+                    log.debug(f"Poll stats: {poll_cache.stats()}")
+                    if scheduler.observe(TheReading.epoch):
+                        scheduler.log_stats()
+            except:
+                scheduler.observe(None)
+                log.info("Exception processing The Reading, Sleeping and trying again....")
+        if TheReading:
+            display_reading(TheReading, BGDifference)
+        # Wake for whichever comes first: the next poll, or the next change to the on-screen text.
+        epoch = TheReading.epoch if TheReading else None
+        sleep(max(0.05, min(scheduler.delay(), renders.delay([epoch]))))
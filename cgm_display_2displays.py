@@ -5,7 +5,6 @@ import datetime
 import logging
 import os
 import sys
-import threading
 import platform
 import re
 import requests
@@ -13,9 +12,16 @@ import time
 import urllib
 import urllib.parse #Python3 requires this
 import http_general
+import metrics
+import dexcom_accounts
+import normalize
 from time import sleep
-#from Defaults import Defaults, Error, AuthError, FetchError
-from Defaults import Defaults
+from Defaults import Defaults, AuthError, FetchError
+from dexcom_accounts import DexcomAccount, MultiAccountPoller
+from readings import Reading, format_delta
+from render_scheduler import RenderScheduler
+from asset_cache import AssetCache
+from text_cache import TextCache
 
 #Process command line arguments
 ArgParser=argparse.ArgumentParser(description="Handle Command Line Arguments")
@@ -27,8 +33,11 @@ ArgParser.add_argument("--username2", "-u2", help="Dexcom Share User Name 2")
 ArgParser.add_argument("--password2", "-p2", help="Dexcom Share Password 2")
 ArgParser.add_argument("--image2", "-i2", help="Image file for second person")
 ArgParser.add_argument("--polling_interval", help="Polling interval for getting updates from Dexcom")
-ArgParser.add_argument("--time_ago_interval", help="Polling interval for updating the \"Time Ago\" detail")
+ArgParser.add_argument("--time_ago_interval", help="Unused: the display now repaints exactly when the \"Time Ago\" text changes")
+ArgParser.add_argument("--dexcom_url", help="Dexcom Share base URL (Default: share1.dexcom.com or $DEXCOM_SHARE_URL)")
 args=ArgParser.parse_args()
+if args.dexcom_url:
+    Defaults.use_dexcom_share_url(args.dexcom_url)
 
 # On Raspberry Pi with LCD display only
 if  platform.platform().find("arm") >= 0:
@@ -37,6 +46,8 @@ if  platform.platform().find("arm") >= 0:
     os.putenv('SDL_FBDEV', '/dev/fb1')
     pygame.init()
     lcd=pygame.display.set_mode((480, 320))
+    text_cache=TextCache(pygame)
+    assets=AssetCache(pygame) # Account photos are loaded and converted once, not every tick
 
 log = logging.getLogger(__file__)
 log.setLevel(logging.ERROR)
@@ -55,64 +66,34 @@ if args.logging == "DEBUG":
 
 log.debug("Running with command line: " + str(sys.argv))
 
-global TheReading
-
-if args.username != None:
-    DEXCOM_ACCOUNT_NAME = args.username
-else:
-    DEXCOM_ACCOUNT_NAME = Config.get("dexcomshare", "dexcom_share_login")
-
-if args.password != None:
-    DEXCOM_PASSWORD = args.password
-else:
-    DEXCOM_PASSWORD = Config.get("dexcomshare", "dexcom_share_password")
-
-if args.image != None:
-    IMAGE_FILE = args.image
-else:
-    IMAGE_FILE = Config.get("dexcomshare", "image_file")
-
-if args.username2 != None:
-    DEXCOM_ACCOUNT_NAME2 = args.username2
-else:
-    DEXCOM_ACCOUNT_NAME2 = Config.get("dexcomshare", "dexcom_share_login2")
-
-if args.password2 != None:
-    DEXCOM_PASSWORD2 = args.password2
-else:
-    DEXCOM_PASSWORD2 = Config.get("dexcomshare", "dexcom_share_password2")
-
-if args.image2 != None:
-    IMAGE_FILE2 = args.image2
-else:
-    IMAGE_FILE2 = Config.get("dexcomshare", "image_file2")
+BASE_DIR = os.path.dirname(os.path.realpath(__file__))
 
 if args.polling_interval != None:
     CHECK_INTERVAL = int(args.polling_interval)
 else:
     CHECK_INTERVAL = int(Config.get("dexcomshare", "polling_interval"))
 
-if args.time_ago_interval != None:
-    TIME_AGO_INTERVAL = int(args.time_ago_interval)
-else:
-    TIME_AGO_INTERVAL = int(Config.get("dexcomshare","time_ago_interval"))
-
-# Load up the two different user credentials
-global DexcomUser
-DexcomUser = []
-DexcomUser.append({"username" : DEXCOM_ACCOUNT_NAME,
-                   "password" : DEXCOM_PASSWORD,
-                   "session_id" : None,
-                   "image" : os.path.dirname(os.path.realpath(__file__))+"/"+IMAGE_FILE})
-
-DexcomUser.append({"username" : DEXCOM_ACCOUNT_NAME2,
-                   "password" : DEXCOM_PASSWORD2,
-                   "session_id" : None,
-                   "image" : os.path.dirname(os.path.realpath(__file__))+"/"+IMAGE_FILE2})
+MAX_WORKERS = Config.getint("dexcomshare", "max_workers", fallback=4)
+
+# Load every configured account ([account:<label>] sections, or the legacy two-user keys).
+# Credentials given on the command line replace the first two accounts.
+global Accounts
+Accounts = dexcom_accounts.load_accounts(Config, BASE_DIR)
+for index, (username, password, image) in enumerate(((args.username, args.password, args.image),
+                                                     (args.username2, args.password2, args.image2))):
+    if username == None:
+        continue
+    account = DexcomAccount(username, password, image=BASE_DIR+"/"+image if image else None)
+    if index < len(Accounts):
+        Accounts[index] = account
+    else:
+        Accounts.append(account)
+log.debug("Polling accounts: " + str(Accounts))
 
 AUTH_RETRY_DELAY_BASE = 2
 FAIL_RETRY_DELAY_BASE = 2
 MAX_AUTHFAILS = Config.get("dexcomshare", "max_auth_fails")
+http_general.MAX_AUTHFAILS = MAX_AUTHFAILS
 MAX_FETCHFAILS = 10
 RETRY_DELAY = 60 # Seconds
 LAST_READING_MAX_LAG = 60 * 7.5
@@ -125,103 +106,81 @@ def isNightTime():
         return False
 
 def parse_dexcom_response(ops, res):
-    log.debug(res.json())
-    epochtime = int((datetime.datetime.utcnow() - datetime.datetime(1970, 1, 1)).total_seconds())
-    try:
-        last_reading_time = int(re.search('\d+', res.json()[0]['ST']).group())/1000
-        reading_lag = epochtime - last_reading_time
-        trend = res.json()[0]['Trend']
-        mgdl = res.json()[0]['Value']
-        
-        #trend_english = DIRECTIONS.keys()[DIRECTIONS.values().index(trend)] # Python2 version
-        trend_english=list(Defaults.DIRECTIONS.keys())[list(Defaults.DIRECTIONS.values()).index(trend)] # Python3 version
-        log.info("Last bg: {}  trending: {} ({})  last reading at: {} seconds ago".format(mgdl, trend_english, trend, reading_lag))
-        if reading_lag > LAST_READING_MAX_LAG:
-            log.warning("***WARN It has been {} minutes since DEXCOM got a new measurement".format(int(reading_lag/60)))
-            last_reading_lag = True
-        else:
-            last_reading_lag = False
-        return {
-                "bg": mgdl,
-                "trend": trend,
-                "trend_english": trend_english,
-                "reading_lag": reading_lag,
-                "last_reading_time": last_reading_time,
-                "last_reading_lag": last_reading_lag
-                }
-    except IndexError:
-        log.error(
-                "Caught IndexError: return code:{} ... response output" +
-                " below".format(res.status_code))
+    """ Decode the response once into the newest reading """
+    log.debug(res.text)
+    readings = normalize.dexcom_readings(normalize.decode(res))
+    if not readings:
+        log.error("No readings in response for {}: return code:{} ... response output below".format(ops.label, res.status_code))
         log.error(res.__dict__)
         return None
-
-def monitor_dexcom(user):
-    """ Main loop """
-    opts = Defaults
-    #opts.accountName = os.getenv("DEXCOM_ACCOUNT_NAME", DEXCOM_ACCOUNT_NAME)
-    #opts.password = os.getenv("DEXCOM_PASSWORD", DEXCOM_PASSWORD)
-    opts.accountName = user["username"]
-    opts.password = user["password"]
-    opts.sessionID = user["session_id"]
-    opts.interval = float(os.getenv("CHECK_INTERVAL", CHECK_INTERVAL))
+    reading = readings[0]
+    reading_lag = reading.age()
+    log.info("Last bg: {}  trending: {} ({})  last reading at: {} seconds ago".format(reading.mgdl, reading.direction, reading.trend, reading_lag))
+    if reading_lag > LAST_READING_MAX_LAG:
+        log.warning("***WARN It has been {} minutes since DEXCOM got a new measurement".format(int(reading_lag/60)))
+    return reading
+
+def monitor_dexcom(account):
+    """ Fetch the latest reading for one account.  Safe to run for several accounts at once """
+    opts = account
     fetchfails = 0
     failures = 0
-    #log.debug("RUNNING {}, failures: {}".format(runs, failures))
     try:
-        if not opts.sessionID:
-            authfails = 0
-            opts.sessionID = http_general.get_sessionID(opts)
-            user["session_id"] = opts.sessionID
-            log.debug("Got auth token {}".format(opts.sessionID))
+        # Uses the in-memory or on-disk cached session; only logs in when neither is valid
+        opts.sessionID = http_general.get_sessionID(opts)
         res = http_general.fetch(opts)
         if res and res.status_code < 400:
-            fetchfails = 0
             reading = parse_dexcom_response(opts, res)
             if reading:
-                # On Raspberry Pi with LCD display only
-                #if  platform.platform().find("arm") >= 0:
-                #    display_reading(reading,0)
-                    #sleep(180)
                 return reading
             else:
+                metrics.fetch_failed("dexcom")
                 opts.sessionID = None
                 log.error("parse_dexcom_response returned None.  Investigate above logs")
-                if run_once:
-                    return None
+                return None
         else:
             failures += 1
-            opts.sessionID = None
-            user["session_id"] = None
-            log.warning("Saw an error from the dexcom api, code: {}.  details to follow".format(res.status_code))
-            raise opts.FetchError(res.status_code, res)
-            log.warning("Fetch failed on: {}".format(res.status_code))
-            return
-            if fetchfails > (MAX_FETCHFAILS/2):
-                log.warning("Trying to re-auth...")
-                opts.sessionID = None
-            else:
-                log.warning("Trying again...")
-            #time.sleep((FAIL_RETRY_DELAY_BASE**authfails))
-            fetchfails += 1
+            if http_general.is_session_error(res):
+                http_general.invalidate_session(opts)
+            log.warning("Saw an error from the dexcom api for {}, code: {}.  details to follow".format(opts.label, res.status_code))
+            raise FetchError(res.status_code, res)
 
     except ConnectionError:
+        metrics.fetch_failed("dexcom")
         opts.sessionID = None
-        raise log.warning("Cnnection Error.. sleeping for {} seconds and".format(RETRY_DELAY) + " trying again")
-        time.sleep(RETRY_DELAY)
+        log.warning("Connection Error for {}.. trying again next poll".format(opts.label))
     except AuthError:
+        metrics.fetch_failed("dexcom")
         log.error("Authentication error connecting to Dexcom share")
         return False
     except:
+        metrics.fetch_failed("dexcom")
         log.debug("Caught exception communicating with Dexcom:  Returning False")
         return False
 
     return False
 
-def display_reading(reading, bgdelta, reading2, bgdelta2):
-    log.debug("Displaying User 1 with Reading of " + str(reading) + " and a change of " + '{0:{1}}'.format(bgdelta, '+' if bgdelta else ''))
+def update_readings(poller):
+    """ Poll every account concurrently and work out each account's change since its last reading """
+    for account, reading in zip(poller.accounts, poller.poll()):
+        if not reading:
+            log.info("No new reading for " + account.label)
+            continue
+        if not account.reading or reading.epoch != account.reading.epoch:
+            account.bg_delta = account.trends.add(reading).delta
+            log.debug(account.label + " Difference of " + format_delta(account.bg_delta))
+        account.reading = reading
+
+def time_ago_text(reading):
+    difference = round(reading.age()/60)
+    if difference == 0:
+        return difference, "Just Now"
+    elif difference == 1:
+        return difference, str(difference) + " Minute Ago"
+    else:
+        return difference, str(difference) + " Minutes Ago"
 
-    #log.debug("Differeince is " + '{0:{1}}'.format(number, '+' if number else ''))
+def display_reading(accounts):
     # On Raspberry Pi with LCD display only
     if not platform.platform().find("arm") >= 0:
         log.debug("Skipping display.  Not on Raspberry Pi")
@@ -229,136 +188,79 @@ def display_reading(reading, bgdelta, reading2, bgdelta2):
     global pygame, lcd
     log.debug("Getting ready to display on the LCD panel")
 
-    now = datetime.datetime.utcnow()
-    reading_time = datetime.datetime.utcfromtimestamp(reading["last_reading_time"])
-    reading_time2 = datetime.datetime.utcfromtimestamp(reading2["last_reading_time"])
-    difference = round((now - reading_time).total_seconds()/60)
-    difference2 = round((now - reading_time2).total_seconds()/60)
-    log.debug("Time difference since last good reading is: " + str(difference))
-    if difference == 0:
-        str_difference = "Just Now"
-    elif difference == 1:
-        str_difference = str(difference) + " Minute Ago"
-    else:
-        str_difference = str(difference) + " Minutes Ago"
-    log.debug("Time difference since last good reading2 is: " + str(difference2))
-    if difference2 == 0:
-        str_difference2 = "Just Now"
-    elif difference2 == 1:
-        str_difference2 = str(difference2) + " Minute Ago"
-    else:
-        str_difference2 = str(difference2) + " Minutes Ago"
+    width, height = lcd.get_size()
+    band = height // max(1, len(accounts))
+    scale = band / 160 # Layout below was designed for two 160 pixel bands
 
-    log.info("About to update Time Ago Display with reading from " + str_difference + " and " + str_difference2)
-    log.debug("About to acquire lock with: "+str(lock))
-    lock.acquire(blocking=True)
-    log.debug("Acquired lock "+str(lock))
-
-    try:
 # We're not using Night mode for the dual display.
-#         if isNightTime():
-#            log.debug("Setting to Nighttime mode")
-#            lcd.fill(Defaults.BLACK)
-#            font_color=Defaults.GREY
-#         else:
-#            log.debug("Setting to Daylight mode")
-#            lcd.fill(Defaults.BLUE)
-#            font_color=Defaults.WHITE
-
-        lcd.fill(Defaults.BLUE)
-        font_color=Defaults.WHITE
-
-        #Lower rectangle
-        pygame.draw.rect(lcd,(255,0,0),(0,161,480,160))
+    lcd.fill(Defaults.BLUE)
+    font_color=Defaults.WHITE
+
+    for index, account in enumerate(accounts):
+        top = index * band
+        left_side = index % 2 == 0
+        # Alternate bands: image on the left over blue, image on the right over red
+        if not left_side:
+            pygame.draw.rect(lcd,(255,0,0),(0,top+1,width,band))
+        if account.image:
+            # Shrink the photo to fit its band (with the 5 pixel margin), keeping its aspect ratio
+            image = assets.load(account.image)
+            image_width, image_height = image.get_size()
+            fit = min(1, (band-10)/image_height) if image_height else 1
+            if fit < 1:
+                image = assets.load(account.image, (max(1, round(image_width*fit)), max(1, round(image_height*fit))))
+            lcd.blit(image,(5,top+5) if left_side else (390,top+5))
+
+        reading = account.reading
+        if reading:
+            difference, str_difference = time_ago_text(reading)
+            if (reading.age() > LAST_READING_MAX_LAG) or (difference > round(LAST_READING_MAX_LAG/60)):
+               str_reading = "---"
+            else:
+               str_reading = str(reading.mgdl)+reading.arrow
+        else:
+            str_difference = account.label
+            str_reading = "---"
+        log.debug(account.label + ": " + str_difference + " " + str_reading)
 
-        # Display the images
-        lcd.blit(pygame.image.load(DexcomUser[0]["image"]),(5,5))
-        lcd.blit(pygame.image.load(DexcomUser[1]["image"]),(390,165))        
-        
         #Time Ago
-        font_time = pygame.font.Font(None, 45)
-        text_surface = font_time.render(str_difference, True, font_color)
-        rect = text_surface.get_rect(center=(230,20))
-        lcd.blit(text_surface, rect)
-        text_surface = font_time.render(str_difference2, True, font_color)
-        rect = text_surface.get_rect(center=(230,160+20))
+        text_surface = text_cache.render(str_difference, round(45*scale), font_color)
+        rect = text_surface.get_rect(center=(230,top+round(20*scale)))
         lcd.blit(text_surface, rect)
 
         #Reading
-        font_big = pygame.font.Font(None, 145)
-        trend_index = reading["trend"]
-        if (reading["last_reading_lag"] == True) or (difference > round(LAST_READING_MAX_LAG/60)):
-           str_reading = "---"
-        else:
-           str_reading = str(reading["bg"])+Defaults.ARROWS[str(trend_index)]
-        text_surface = font_big.render(str_reading, True, font_color)
-        rect = text_surface.get_rect(center=(225,90))
-        lcd.blit(text_surface, rect)
-        trend_index = reading2["trend"]
-        if (reading2["last_reading_lag"] == True) or (difference2 > round(LAST_READING_MAX_LAG/60)):
-           str_reading2 = "---"
-        else:
-           str_reading2 = str(reading2["bg"])+Defaults.ARROWS[str(trend_index)]
-        text_surface = font_big.render(str_reading2, True, font_color)
-        rect = text_surface.get_rect(center=(160,160+90))
+        text_surface = text_cache.render(str_reading, round(145*scale), font_color)
+        rect = text_surface.get_rect(center=(225 if left_side else 160,top+round(90*scale)))
         lcd.blit(text_surface, rect)
 
-        #Trend Number        
-        font_medium = pygame.font.Font(None, 90)
-        text_surface = font_medium.render('{0:{1}}'.format(bgdelta, '+' if bgdelta else ''),True,font_color)
-        rect = text_surface.get_rect(center=(405, 90))
-        lcd.blit(text_surface, rect)
-        text_surface = font_medium.render('{0:{1}}'.format(bgdelta2, '+' if bgdelta2 else ''),True,font_color)
-        rect = text_surface.get_rect(center=(360, 160+90))
+        #Trend Number
+        text_surface = text_cache.render(format_delta(account.bg_delta), round(90*scale), font_color)
+        rect = text_surface.get_rect(center=(405 if left_side else 360, top+round(90*scale)))
         lcd.blit(text_surface, rect)
 
-        pygame.display.update()
-        pygame.mouse.set_visible(False)
-    finally:
-        log.debug("About to release lock: "+str(lock))
-        lock.release()
-        log.debug("Lock released: "+str(lock))
+    pygame.display.update()
+    pygame.mouse.set_visible(False)
+    log.debug("Text cache: " + str(text_cache.stats()))
    
-def TimeAgoThread():
-    global TheReading, BGDifference
-    #log.debug("Differeince is " + '{0:{1}}'.format(number, '+' if number else ''))
-    while True:
-        display_reading(TheReading, BGDifference,TheReading2, BGDifference2)
-        sleep(TIME_AGO_INTERVAL)
-
 if __name__ == '__main__':      
-    lock = threading.RLock()
-    log.debug("Created lock: " + str(lock))
-    
-    LastReading = 0
-    BGDifference = 0
-    TheReading = False
-    LastReading2 = 0
-    BGDifference2 = 0
-    TheReading2 = False
-    
-    TheReading=monitor_dexcom(DexcomUser[0]) #One initial reading to have data for the TimeAgo Thread before we get into the main loop
-    TheReading2=monitor_dexcom(DexcomUser[1])
+    poller = MultiAccountPoller(Accounts, monitor_dexcom, MAX_WORKERS)
+    # Repaints happen only when some account's "Time Ago" text changes, not on a fixed tick.
+    renders = RenderScheduler(night_hours=())
+    update_readings(poller)
+    next_poll = time.time() + CHECK_INTERVAL
     i = 1
 
-    TimeAgo = threading.Thread(target=TimeAgoThread)
-    TimeAgo.setName("TimeAgoThread")
-    TimeAgo.start()
-    sleep(CHECK_INTERVAL)
-
     while True:
-        i += 1
-        try:  
-            log.debug("Iteration #"+str(i) + "-" + str(TheReading))
-            LastReading = TheReading["bg"]
-            TheReading=monitor_dexcom(DexcomUser[0])
-            BGDifference = TheReading["bg"] - LastReading
-            log.debug("User 1 Difference of " + str(BGDifference))
-
-            LastReading2 = TheReading2["bg"]
-            TheReading2=monitor_dexcom(DexcomUser[1])
-            BGDifference2 = TheReading2["bg"] - LastReading2
-            log.debug("User 2 Difference of " + str(BGDifference2))
-        except:
-            log.info("Exception processing The Reading, Sleeping and trying again....")
-        sleep(CHECK_INTERVAL)
+        if time.time() >= next_poll:
+            i += 1
+            try:
+                log.debug("Iteration #"+str(i))
+                started = time.time()
+                update_readings(poller)
+                log.debug("Polled {} accounts in {:.2f} seconds".format(len(Accounts), time.time() - started))
+            except:
+                log.info("Exception processing The Reading, Sleeping and trying again....")
+            next_poll = time.time() + CHECK_INTERVAL
+        display_reading(Accounts)
+        epochs = [account.reading.epoch for account in Accounts if account.reading]
+        sleep(max(0.05, min(next_poll - time.time(), renders.delay(epochs))))
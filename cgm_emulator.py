@@ -0,0 +1,432 @@
+"""Local stand-in for Dexcom Share, Nightscout and Sugarmate.
+
+Serves the endpoints the displays poll from a synthetic glucose curve, with
+optional latency, random errors, 401/500 bursts, expiring sessions and
+slow-drip responses, so the pollers can be load- and fault-tested offline.
+
+    python3 cgm_emulator.py --port 8080 --latency 200 --error_rate 0.05
+
+Then point the clients at it:
+    Dexcom:     --dexcom_url http://127.0.0.1:8080/ShareWebServices/Services  (or DEXCOM_SHARE_URL)
+    Nightscout: nightscout -ns http://127.0.0.1:8080
+    Sugarmate:  --sugarmate_url http://127.0.0.1:8080/api/v1                  (or SUGARMATE_URL)
+
+With --stream_port (needs python-socketio and aiohttp) it also pushes the
+Nightscout socket.io feed, for nightscout --stream.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import http.server
+import json
+import math
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+from typing import Any, Optional
+
+from Defaults import Defaults
+from logger import log
+from readings import READING_INTERVAL
+
+# Dexcom sessions kept at most (even with --session_ttl 0); an evicted client just logs in again.
+MAX_SESSIONS = 1000
+
+_TREND_NAMES = {code: name for name, code in reversed(list(Defaults.DIRECTIONS.items()))}
+_SUGARMATE_TREND_WORDS = {
+    1: "DOUBLE_UP", 2: "SINGLE_UP", 3: "FORTY_FIVE_UP", 4: "FLAT",
+    5: "FORTY_FIVE_DOWN", 6: "SINGLE_DOWN", 7: "DOUBLE_DOWN",
+}
+
+
+def _devicestatus(now: float) -> dict[str, Any]:
+    # Loop runs shortly after each reading arrives.
+    last_loop = now - now % READING_INTERVAL + 20
+    if last_loop > now:
+        last_loop -= READING_INTERVAL
+    stamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(last_loop))
+    return {"device": "loop://cgm_emulator", "created_at": stamp, "mills": int(last_loop * 1000),
+            "loop": {"name": "Loop", "timestamp": stamp}}
+
+
+class GlucoseCurve:
+    """Deterministic synthetic CGM trace: slow meal/basal waves plus seeded sensor noise."""
+
+    def __init__(self, *, seed: int = 1, base: float = 130, amplitude: float = 60) -> None:
+        self._seed = seed
+        self._base = base
+        self._amplitude = amplitude
+
+    def value(self, epoch: float) -> int:
+        hours = epoch / 3600
+        noise = random.Random(self._seed * 1_000_003 + int(epoch // READING_INTERVAL)).uniform(-4, 4)
+        mgdl = (self._base
+                + self._amplitude * math.sin(2 * math.pi * hours / 5.3)
+                + 0.35 * self._amplitude * math.sin(2 * math.pi * hours / 1.1)
+                + noise)
+        return int(min(400, max(40, round(mgdl))))
+
+    def trend(self, epoch: float) -> int:
+        per_minute = (self.value(epoch) - self.value(epoch - READING_INTERVAL)) / (READING_INTERVAL / 60)
+        for limit, code in ((-3, 7), (-2, 6), (-1, 5), (1, 4), (2, 3), (3, 2)):
+            if per_minute < limit:
+                return code
+        return 1
+
+    def readings(self, now: float, count: int, after: Optional[float] = None) -> list[tuple[float, int, int]]:
+        """Up to ``count`` (epoch, mg/dL, trend) readings, newest first, optionally only those after ``after``."""
+
+        newest = now - now % READING_INTERVAL
+        result = []
+        for i in range(max(0, count)):
+            epoch = newest - i * READING_INTERVAL
+            if after is not None and epoch <= after:
+                break
+            result.append((epoch, self.value(epoch), self.trend(epoch)))
+        return result
+
+
+class Faults:
+    """What can go wrong, and when."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.latency = args.latency / 1000
+        self.jitter = args.jitter / 1000
+        self.error_rate = args.error_rate
+        self.burst_status = args.burst_status
+        self.burst_every = args.burst_every
+        self.burst_length = args.burst_length
+        self.slow_drip_rate = args.slow_drip_rate
+        self.slow_drip_bps = args.slow_drip_bps
+        self.session_ttl = args.session_ttl
+        self._random = random.Random(args.seed)
+        self._lock = threading.Lock()
+        self._started = time.time()
+
+    def roll(self) -> float:
+        with self._lock:
+            return self._random.random()
+
+    def delay(self) -> float:
+        with self._lock:
+            return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def in_burst(self) -> bool:
+        if not self.burst_every or not self.burst_length:
+            return False
+        # The first burst comes after one healthy period, not at startup.
+        elapsed = time.time() - self._started
+        return elapsed >= self.burst_every and elapsed % self.burst_every < self.burst_length
+
+    def slow_drip(self) -> bool:
+        return self.slow_drip_bps > 0 and self.roll() < self.slow_drip_rate
+
+
+class EmulatorHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+    server: "EmulatorServer"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        log.debug("%s - %s" % (self.address_string(), format % args))
+
+    # ---- plumbing ----------------------------------------------------------------
+
+    def _send(self, status: int, body: Any, *, etag: bool = False) -> None:
+        payload = body if isinstance(body, bytes) else json.dumps(body, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if etag and status == 200:
+            tag = '"' + hashlib.sha1(payload).hexdigest() + '"'
+            headers["ETag"] = tag
+            if self.headers.get("If-None-Match") == tag:
+                status, payload = 304, b""
+        self.server.count(status)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        if not payload:
+            return
+        if self.server.faults.slow_drip():
+            # Trickle the body out so clients hit their read timeouts mid-response.
+            chunk = max(1, self.server.faults.slow_drip_bps // 10)
+            for start in range(0, len(payload), chunk):
+                self.wfile.write(payload[start:start + chunk])
+                self.wfile.flush()
+                time.sleep(0.1)
+        else:
+            self.wfile.write(payload)
+
+    def _fault(self, dexcom: bool) -> bool:
+        """Apply latency and injected failures; True if a failure response was sent."""
+
+        faults = self.server.faults
+        time.sleep(faults.delay())
+        if faults.in_burst():
+            if faults.burst_status == 500 and dexcom:
+                self._send(500, {"Code": "SessionNotValid", "Message": "Session ID not valid (emulated burst)"})
+            else:
+                self._send(faults.burst_status, {"status": faults.burst_status, "message": "emulated burst"})
+            return True
+        if faults.error_rate and faults.roll() < faults.error_rate:
+            self._send(500, {"status": 500, "message": "emulated error"})
+            return True
+        return False
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    # ---- routing -----------------------------------------------------------------
+
+    def do_POST(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        body = self._read_body()
+        if url.path.endswith("/General/LoginPublisherAccountByName"):
+            if not self._fault(dexcom=True):
+                self._dexcom_login(body)
+        elif url.path.endswith("/Publisher/ReadPublisherLatestGlucoseValues"):
+            if not self._fault(dexcom=True):
+                self._dexcom_values(query)
+        else:
+            self._send(404, {"status": 404})
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        path = url.path.rstrip("/")
+        if path in ("/api/v1/entries/sgv", "/api/v1/entries/sgv.json", "/api/v1/entries", "/api/v1/entries.json"):
+            if not self._fault(dexcom=False):
+                self._nightscout_entries(query)
+        elif path in ("/api/v1/devicestatus", "/api/v1/devicestatus.json"):
+            if not self._fault(dexcom=False):
+                self._nightscout_devicestatus()
+        elif path.startswith("/api/v1/") and path.endswith("/latest.json"):
+            if not self._fault(dexcom=False):
+                self._sugarmate_latest()
+        elif path == "/stats":
+            self._send(200, self.server.stats())
+        else:
+            self._send(404, {"status": 404})
+
+    # ---- Dexcom Share ------------------------------------------------------------
+
+    def _dexcom_login(self, body: bytes) -> None:
+        try:
+            credentials = json.loads(body or b"{}")
+        except ValueError:
+            credentials = {}
+        required = self.server.password
+        if not credentials.get("accountName") or (required and credentials.get("password") != required):
+            self._send(500, {"Code": "AccountPasswordInvalid", "Message": "Publisher account password failed"})
+            return
+        self._send(200, json.dumps(self.server.new_session()).encode("utf-8"))
+
+    def _dexcom_values(self, query: dict) -> None:
+        if not self.server.session_valid(query.get("sessionID", [""])[0]):
+            self._send(500, {"Code": "SessionIdNotFound", "Message": "Session ID not found"})
+            return
+        minutes = int(query.get("minutes", ["1440"])[0])
+        count = min(int(query.get("maxCount", ["1"])[0]), minutes * 60 // READING_INTERVAL + 1)
+        values = []
+        for epoch, mgdl, trend in self.server.curve.readings(time.time(), count):
+            stamp = f"Date({int(epoch * 1000)})"
+            values.append({"WT": stamp, "ST": stamp, "DT": f"Date({int(epoch * 1000)}+0000)",
+                           "Value": mgdl, "Trend": _TREND_NAMES.get(trend, "Flat")})
+        self._send(200, values)
+
+    # ---- Nightscout --------------------------------------------------------------
+
+    def _nightscout_entries(self, query: dict) -> None:
+        count = int(query.get("count", ["10"])[0])
+        after = query.get("find[date][$gt]", [None])[0]
+        readings = self.server.curve.readings(time.time(), count, None if after is None else int(after) / 1000)
+        entries = []
+        for epoch, mgdl, trend in readings:
+            ms = int(epoch * 1000)
+            entries.append({
+                "_id": f"{ms:024x}", "device": "cgm_emulator", "date": ms,
+                "dateString": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(epoch)),
+                "sgv": mgdl, "direction": _TREND_NAMES.get(trend, "Flat"), "type": "sgv",
+            })
+        self._send(200, entries, etag=True)
+
+    def _nightscout_devicestatus(self) -> None:
+        self._send(200, [_devicestatus(time.time())], etag=True)
+
+    # ---- Sugarmate ---------------------------------------------------------------
+
+    def _sugarmate_latest(self) -> None:
+        (epoch, mgdl, trend), (_, previous, _) = self.server.curve.readings(time.time(), 2)
+        delta = mgdl - previous
+        arrow = Defaults.ARROWS.get(str(trend), "")
+        self._send(200, {
+            "time": time.strftime("%I:%M%p", time.localtime(epoch)).lstrip("0"),
+            "value": mgdl, "delta": delta, "x": int(epoch),
+            "trend_words": _SUGARMATE_TREND_WORDS.get(trend, "FLAT"), "trend_symbol": arrow,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(epoch)),
+            "reading": f"{mgdl} {arrow} {delta:+d}", "units": "mg/dL",
+        }, etag=True)
+
+
+class EmulatorServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], curve: GlucoseCurve, faults: Faults, password: Optional[str] = None) -> None:
+        super().__init__(address, EmulatorHandler)
+        self.curve = curve
+        self.faults = faults
+        self.password = password
+        self._sessions: dict[str, float] = {}
+        self._responses: dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def _prune_sessions(self, now: float) -> None:
+        """Forget expired sessions, and the oldest beyond MAX_SESSIONS; call with the lock held."""
+
+        ttl = self.faults.session_ttl
+        # Sessions are kept in creation order, so the expired ones are at the front.
+        for session_id, created in list(self._sessions.items()):
+            if len(self._sessions) <= MAX_SESSIONS and not (ttl and now - created >= ttl):
+                break
+            del self._sessions[session_id]
+
+    def new_session(self) -> str:
+        session_id = str(uuid.uuid4())
+        now = time.time()
+        with self._lock:
+            self._sessions[session_id] = now
+            self._prune_sessions(now)
+        return session_id
+
+    def session_valid(self, session_id: str) -> bool:
+        with self._lock:
+            self._prune_sessions(time.time())
+            return session_id in self._sessions
+
+    def count(self, status: int) -> None:
+        with self._lock:
+            self._responses[status] = self._responses.get(status, 0) + 1
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {"responses": {str(k): v for k, v in sorted(self._responses.items())},
+                    "sessions": len(self._sessions)}
+
+
+class StreamEmulator:
+    """Nightscout's socket.io live feed: ``authorize``, then a full ``dataUpdate`` and a delta per reading.
+
+    Runs its own aiohttp server (python-socketio and aiohttp must be installed).
+    ``drop_every`` disconnects every client periodically to exercise the
+    display's fallback to polling.
+    """
+
+    def __init__(self, curve: GlucoseCurve, *, drop_every: float = 0) -> None:
+        import socketio
+
+        self.curve = curve
+        self.drop_every = drop_every
+        self.sio = socketio.AsyncServer(async_mode="aiohttp", cors_allowed_origins="*")
+        self.sio.on("authorize", self._authorize)
+        self.updates = 0
+
+    def _update(self, now: float, count: int, *, delta: bool) -> dict[str, Any]:
+        sgvs = [{"mills": int(epoch * 1000), "mgdl": mgdl, "direction": _TREND_NAMES.get(trend, "Flat"),
+                 "device": "cgm_emulator", "type": "sgv"}
+                for epoch, mgdl, trend in reversed(self.curve.readings(now, count))]
+        return {"delta": delta, "lastUpdated": int(now * 1000), "sgvs": sgvs, "devicestatus": [_devicestatus(now)]}
+
+    async def _authorize(self, sid: str, message: Any) -> dict[str, Any]:
+        hours = int(message.get("history", 48)) if isinstance(message, dict) else 48
+        await self.sio.enter_room(sid, "authorized")
+        log.info(f"Stream client {sid} authorized ({hours}h of history)")
+        self.sio.start_background_task(self._send_full, sid, hours)
+        return {"read": True, "write": False, "write_treatment": False}
+
+    async def _send_full(self, sid: str, hours: int) -> None:
+        self.updates += 1
+        await self.sio.emit("dataUpdate", self._update(time.time(), hours * 3600 // READING_INTERVAL, delta=False), to=sid)
+
+    async def _push_loop(self) -> None:
+        last_drop = time.time()
+        while True:
+            now = time.time()
+            # Push shortly after each reading (and Loop run) would have been uploaded.
+            await asyncio.sleep(READING_INTERVAL - now % READING_INTERVAL + 21)
+            self.updates += 1
+            await self.sio.emit("dataUpdate", self._update(time.time(), 1, delta=True), room="authorized")
+            if self.drop_every and time.time() - last_drop >= self.drop_every:
+                last_drop = time.time()
+                for sid in list(self.sio.manager.get_participants("/", "authorized")):
+                    await self.sio.disconnect(sid[0])
+
+    def start(self, host: str, port: int) -> threading.Thread:
+        """Serve on a daemon thread with its own event loop."""
+
+        from aiohttp import web
+
+        async def serve() -> None:
+            app = web.Application()
+            self.sio.attach(app)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, host, port).start()
+            await self._push_loop()
+
+        thread = threading.Thread(target=asyncio.run, args=(serve(),), name="StreamEmulator", daemon=True)
+        thread.start()
+        return thread
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Local Dexcom Share / Nightscout / Sugarmate emulator")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the glucose curve and fault rolls")
+    parser.add_argument("--password", help="Require this Dexcom Share password (any is accepted by default)")
+    parser.add_argument("--latency", type=float, default=0, help="Added latency per request in milliseconds")
+    parser.add_argument("--jitter", type=float, default=0, help="Random +/- latency jitter in milliseconds")
+    parser.add_argument("--error_rate", type=float, default=0, help="Fraction of requests answered with a 500")
+    parser.add_argument("--burst_status", type=int, default=500, choices=[401, 500], help="Status returned during bursts")
+    parser.add_argument("--burst_every", type=float, default=0, help="Start an error burst every N seconds (0: never)")
+    parser.add_argument("--burst_length", type=float, default=30, help="Length of each error burst in seconds")
+    parser.add_argument("--slow_drip_rate", type=float, default=0, help="Fraction of responses trickled out slowly")
+    parser.add_argument("--slow_drip_bps", type=int, default=200, help="Bytes per second for slow-drip responses")
+    parser.add_argument("--session_ttl", type=float, default=0, help="Expire Dexcom sessions after N seconds (0: never)")
+    parser.add_argument("--stream_port", type=int, default=0, help="Also serve the Nightscout socket.io feed on this port (0: off)")
+    parser.add_argument("--stream_drop_every", type=float, default=0, help="Disconnect stream clients every N seconds (0: never)")
+    parser.add_argument("--logging", "-l", default="INFO", help="Logging level: INFO (Default) or DEBUG")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = parse_args(argv)
+    log.setLevel(args.logging.upper())
+    server = EmulatorServer((args.host, args.port), GlucoseCurve(seed=args.seed), Faults(args), args.password)
+    host, port = server.server_address[:2]
+    log.info(f"CGM emulator listening on http://{host}:{port}")
+    log.info(f"  Dexcom Share: http://{host}:{port}/ShareWebServices/Services")
+    log.info(f"  Nightscout:   http://{host}:{port}")
+    log.info(f"  Sugarmate:    http://{host}:{port}/api/v1")
+    if args.stream_port:
+        StreamEmulator(server.curve, drop_every=args.stream_drop_every).start(args.host, args.stream_port)
+        log.info(f"  Nightscout socket.io: http://{host}:{args.stream_port} (nightscout -ns http://{host}:{port} --stream http://{host}:{args.stream_port})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info(f"Exiting; responses sent: {server.stats()['responses']}")
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,289 @@
+"""LAN relay: poll one upstream once, serve a Nightscout-compatible API to every display.
+
+Polls Dexcom Share, Nightscout or Sugarmate on the usual reading-cadence
+schedule (through http_general / Nightscout / the Sugarmate URL, exactly as the
+displays do), keeps the normalized readings in a ring buffer and serves
+
+    /api/v1/entries/sgv     (count and find[date][$gt] queries, like Nightscout)
+    /api/v1/devicestatus    (passed through from Nightscout; [] for other upstreams)
+
+with ETags, so any number of displays can poll it for the cost of a 304:
+
+    python3 cgm_relay.py --port 1337 dexcom -u USER -p PASSWORD
+    python3 cgm_relay.py --port 1337 nightscout -ns https://mynightscout.domain.com
+    python3 cgm_relay.py --port 1337 sugarmate --apikey KEY
+
+    python3 nightscout_display.py nightscout -ns http://relay-host:1337
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import http.server
+import json
+import math
+import threading
+import time
+import urllib.parse
+from typing import Any, Optional
+
+import http_general
+import http_session
+import metrics
+import normalize
+from Defaults import Defaults, FetchError
+from dexcom_accounts import DexcomAccount
+from logger import log
+from nightscout_data import Nightscout
+from poll_scheduler import ReadingScheduler
+from readings import READING_INTERVAL, Reading, ReadingSeries
+
+# A day of readings, the most any display asks for.
+HISTORY_SIZE = 288
+# Nightscout's default when a query has no count.
+DEFAULT_COUNT = 10
+
+
+class DexcomUpstream:
+    source = "dexcom"
+
+    def __init__(self, account: DexcomAccount) -> None:
+        self._account = account
+
+    def poll(self, newest: Optional[float]) -> tuple[list[Reading], Any]:
+        gap = HISTORY_SIZE * READING_INTERVAL if newest is None else max(0, time.time() - newest)
+        max_count = min(HISTORY_SIZE, math.ceil(gap / READING_INTERVAL) + 1)
+        http_general.get_sessionID(self._account)
+        # The whole day, so a newest value older than the gap (warm-up, outages) is still found
+        res = http_general.fetch(self._account, minutes=1440, max_count=max_count)
+        if res.status_code >= 400:
+            if http_general.is_session_error(res):
+                http_general.invalidate_session(self._account)
+            raise FetchError(res.status_code, res)
+        return normalize.dexcom_readings(normalize.decode(res)), None
+
+
+class NightscoutUpstream:
+    source = "nightscout"
+
+    def __init__(self, server: str) -> None:
+        self._client = Nightscout(server, history_size=HISTORY_SIZE)
+
+    def poll(self, newest: Optional[float]) -> tuple[list[Reading], Any]:
+        readings = self._client.getReading()
+        try:
+            devicestatus = self._client.getDeviceStatus()
+        except Exception as e:
+            metrics.fetch_failed("nightscout_devicestatus")
+            log.warning(f"Nightscout devicestatus fetch failed; keeping the last one: {e!r}")
+            devicestatus = None
+        return readings.since(newest) if newest is not None else list(readings), devicestatus
+
+
+class SugarmateUpstream:
+    source = "sugarmate"
+
+    def __init__(self, api_key: str) -> None:
+        self._url = Defaults.sugarmate_latest_url(api_key)
+        self._polls = http_session.PollCache()
+
+    def poll(self, newest: Optional[float]) -> tuple[list[Reading], Any]:
+        response = http_session.get_session(self._url).get(self._url, headers=self._polls.headers("latest"))
+        if self._polls.unchanged("latest", response):
+            return [], None
+        response.raise_for_status()
+        reading = normalize.sugarmate_reading(normalize.decode(response))
+        self._polls.store("latest", response, reading)
+        return [reading], None
+
+
+def _entry(reading: Reading) -> dict[str, Any]:
+    ms = int(reading.epoch * 1000)
+    return {
+        "_id": f"{ms:024x}", "device": "cgm_relay", "date": ms,
+        "dateString": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(reading.epoch)),
+        "sgv": reading.mgdl, "direction": reading.direction, "type": "sgv",
+    }
+
+
+def _encode(payload: Any) -> tuple[bytes, str]:
+    body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return body, '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+class Relay:
+    """The cached upstream state, and the encoded responses built from it."""
+
+    def __init__(self, upstream: Any) -> None:
+        self.upstream = upstream
+        self.readings = ReadingSeries(HISTORY_SIZE)
+        self._devicestatus: Any = []
+        self._lock = threading.Lock()
+        # Encoded (body, etag) per response, dropped whenever the data changes. Entries
+        # responses are always the newest n readings, so they are keyed by n, not by the
+        # query (whose count and $gt differ from display to display and poll to poll).
+        self._responses: dict[Any, tuple[bytes, str]] = {}
+        self.polls = 0
+        self.requests = 0
+        self.not_modified = 0
+
+    def update(self) -> Optional[float]:
+        """Poll the upstream once; returns the newest reading time (None if the poll failed)."""
+
+        self.polls += 1
+        try:
+            readings, devicestatus = self.upstream.poll(self.readings.newest_epoch())
+        except Exception as e:
+            metrics.fetch_failed(self.upstream.source)
+            log.error(f"{self.upstream.source} poll failed; serving the last readings: {e!r}")
+            return None
+        with self._lock:
+            added = self.readings.extend(readings)
+            changed = added > 0
+            if devicestatus is not None and devicestatus != self._devicestatus:
+                self._devicestatus = devicestatus
+                changed = True
+            if changed:
+                self._responses.clear()
+        log.info(f"Polled {self.upstream.source}: {added} new readings ({len(self.readings)} held)")
+        return self.readings.newest_epoch()
+
+    def response(self, path: str, query: dict[str, list[str]]) -> tuple[bytes, str]:
+        with self._lock:
+            key: Any = path if path == "/api/v1/devicestatus" else self._tail_length(query)
+            cached = self._responses.get(key)
+            if cached is not None:
+                return cached
+            if path == "/api/v1/devicestatus":
+                payload = self._devicestatus
+            else:
+                payload = [_entry(reading) for reading in reversed(self.readings.last(key) if key else [])]
+            cached = self._responses[key] = _encode(payload)
+            return cached
+
+    def _tail_length(self, query: dict[str, list[str]]) -> int:
+        """How many of the newest readings an entries query returns."""
+
+        count = int(query.get("count", [DEFAULT_COUNT])[0])
+        held = len(self.readings)
+        after = query.get("find[date][$gt]", [None])[0]
+        if after is not None:
+            try:
+                # Nightscout takes any number here, fractional milliseconds included.
+                held = len(self.readings.since(float(after) / 1000))
+            except ValueError:
+                pass  # unparseable: like Nightscout, ignore the filter
+        return max(0, min(count, held))
+
+
+class RelayHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+    server: "RelayServer"
+    routes = ("/api/v1/entries/sgv", "/api/v1/entries/sgv.json", "/api/v1/entries", "/api/v1/entries.json",
+              "/api/v1/devicestatus", "/api/v1/devicestatus.json")
+
+    def log_message(self, format: str, *args: Any) -> None:
+        log.debug("%s - %s" % (self.address_string(), format % args))
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        if url.path not in self.routes:
+            self.send_error(404)
+            return
+        relay = self.server.relay
+        relay.requests += 1
+        path = url.path.removesuffix(".json")
+        if path == "/api/v1/entries":
+            path = "/api/v1/entries/sgv"
+        try:
+            body, etag = relay.response(path, urllib.parse.parse_qs(url.query))
+        except ValueError:
+            self.send_error(400)
+            return
+        if self.headers.get("If-None-Match") == etag:
+            relay.not_modified += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class RelayServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], relay: Relay) -> None:
+        super().__init__(address, RelayHandler)
+        self.relay = relay
+
+
+def poll_forever(relay: Relay, polling_interval: float) -> None:
+    # polling_interval is the fallback/backoff ceiling; polls follow the reading cadence.
+    scheduler = ReadingScheduler(fallback_interval=polling_interval, max_backoff=polling_interval)
+    while True:
+        if scheduler.observe(relay.update()):
+            scheduler.log_stats()
+            log.info(f"Relay: {relay.requests} requests served, {relay.not_modified} not modified")
+        time.sleep(scheduler.delay())
+
+
+def parse_args(argv: Optional[list[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Serve a Nightscout-compatible API on the LAN from one upstream")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on (Default: all interfaces)")
+    parser.add_argument("--port", type=int, default=1337, help="Port to listen on")
+    parser.add_argument("--polling_interval", type=float, default=60, help="Longest wait between upstream polls")
+    parser.add_argument("--metrics_port", type=int, help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--logging", "-l", default="INFO", help="Logging level: INFO (Default) or DEBUG")
+    upstreams = parser.add_subparsers(title="upstream", dest="upstream", required=True)
+    dexcom = upstreams.add_parser("dexcom", help="Dexcom Share")
+    dexcom.add_argument("--username", "-u", required=True, help="Dexcom Share User Name")
+    dexcom.add_argument("--password", "-p", required=True, help="Dexcom Share Password")
+    dexcom.add_argument("--dexcom_url", help="Dexcom Share base URL (Default: share1.dexcom.com or $DEXCOM_SHARE_URL)")
+    nightscout = upstreams.add_parser("nightscout", help="Another Nightscout server")
+    nightscout.add_argument("--nightscoutserver", "-ns", required=True, help="Base URL of the Nightscout server")
+    sugarmate = upstreams.add_parser("sugarmate", help="Sugarmate")
+    sugarmate.add_argument("--apikey", "-a", required=True, help="Sugarmate API Key")
+    sugarmate.add_argument("--sugarmate_url", help="Sugarmate API base URL (Default: https://sugarmate.io/api/v1 or $SUGARMATE_URL)")
+    return parser.parse_args(argv)
+
+
+def make_upstream(args: argparse.Namespace) -> Any:
+    if args.upstream == "dexcom":
+        if args.dexcom_url:
+            Defaults.use_dexcom_share_url(args.dexcom_url)
+        return DexcomUpstream(DexcomAccount(args.username, args.password))
+    if args.upstream == "nightscout":
+        return NightscoutUpstream(args.nightscoutserver.rstrip("/"))
+    if args.sugarmate_url:
+        Defaults.sugarmate_url = args.sugarmate_url.rstrip("/")
+    return SugarmateUpstream(args.apikey)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = parse_args(argv)
+    log.setLevel(args.logging.upper())
+    metrics.start_export(port=args.metrics_port)
+    relay = Relay(make_upstream(args))
+    server = RelayServer((args.host, args.port), relay)
+    threading.Thread(target=poll_forever, args=(relay, args.polling_interval), name="RelayPoller", daemon=True).start()
+    host, port = server.server_address[:2]
+    log.info(f"Relaying {args.upstream} as Nightscout on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        log.info(f"Exiting; {relay.polls} upstream polls, {relay.requests} requests served")
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,108 @@
+"""Multiple Dexcom Share accounts polled concurrently.
+
+Each account carries its own credentials, session token and keep-alive HTTP
+session, so accounts never share mutable state (unlike the ``Defaults`` class
+the single-account scripts pass around as ``opts``) and can be fetched in
+parallel on a bounded worker pool.
+"""
+
+from __future__ import annotations
+
+import configparser
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+import http_session
+from Defaults import Defaults
+from logger import log
+from trend_analysis import TrendAnalyzer
+
+ACCOUNT_SECTION_PREFIX = "account:"
+
+
+class DexcomAccount:
+    """Per-account stand-in for the ``opts`` object http_general expects."""
+
+    applicationId = Defaults.applicationId
+
+    def __init__(self, accountName: str, password: str, *, image: Optional[str] = None, label: Optional[str] = None) -> None:
+        self.accountName = accountName
+        self.password = password
+        self.image = image
+        self.label = label or accountName
+        self.sessionID: Optional[str] = None
+        self.session = http_session.PooledSession()
+        self.reading: Any = None
+        self.trends = TrendAnalyzer()
+        self.bg_delta: Optional[int] = None
+
+    def __repr__(self) -> str:
+        return f"DexcomAccount({self.label!r})"
+
+
+def load_accounts(config: configparser.ConfigParser, base_dir: str) -> list[DexcomAccount]:
+    """Read every ``[account:<label>]`` section, falling back to the legacy two-user keys.
+
+    Each account section has ``dexcom_share_login``, ``dexcom_share_password``
+    and optionally ``image_file`` (relative to ``base_dir``).
+    """
+
+    accounts = []
+    for section in config.sections():
+        if not section.startswith(ACCOUNT_SECTION_PREFIX):
+            continue
+        image = config.get(section, "image_file", fallback=None)
+        accounts.append(
+            DexcomAccount(
+                config.get(section, "dexcom_share_login"),
+                config.get(section, "dexcom_share_password"),
+                image=os.path.join(base_dir, image) if image else None,
+                label=section[len(ACCOUNT_SECTION_PREFIX):],
+            )
+        )
+
+    if not accounts and config.has_section("dexcomshare"):
+        for suffix in ("", "2"):
+            login = config.get("dexcomshare", "dexcom_share_login" + suffix, fallback=None)
+            if not login:
+                continue
+            image = config.get("dexcomshare", "image_file" + suffix, fallback=None)
+            accounts.append(
+                DexcomAccount(
+                    login,
+                    config.get("dexcomshare", "dexcom_share_password" + suffix),
+                    image=os.path.join(base_dir, image) if image else None,
+                )
+            )
+    return accounts
+
+
+class MultiAccountPoller:
+    """Run ``fetch`` for every account concurrently; a poll takes as long as the slowest account."""
+
+    def __init__(self, accounts: list[DexcomAccount], fetch: Callable[[DexcomAccount], Any], max_workers: int = 4) -> None:
+        self._accounts = accounts
+        self._fetch = fetch
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, min(max_workers, len(accounts))), thread_name_prefix="DexcomPoll"
+        )
+
+    @property
+    def accounts(self) -> list[DexcomAccount]:
+        return self._accounts
+
+    def _fetch_one(self, account: DexcomAccount) -> Any:
+        try:
+            return self._fetch(account)
+        except Exception as e:
+            log.error(f"Fetch failed for {account.label}: {e!r}")
+            return None
+
+    def poll(self) -> list[Any]:
+        """Fetch all accounts; results are in account order, None for a failed account."""
+
+        return list(self._executor.map(self._fetch_one, self._accounts))
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
@@ -10,10 +10,15 @@ import sys
 import argparse
 import time
 import datetime
-import requests
+import http_session
 import json
+import metrics
+from Defaults import Defaults
+import normalize
 import logging
 from pathlib import Path
+from readings import format_delta
+from trend_analysis import TrendAnalyzer
 
 log = logging.getLogger(__file__)
 log.setLevel(logging.ERROR)
@@ -27,6 +32,9 @@ ArgParser=argparse.ArgumentParser(description="Handle Command Line Arguments")
 ArgParser.add_argument("--apikey", '-a', help="Set your Sugarmate API Key (6 digit code from your Sugarmate Account)")
 ArgParser.add_argument("--polling_interval", help="Polling interval for getting updates from Sugarmate")
 ArgParser.add_argument("--time_ago_interval", help="Polling interval for updating the \"Time Ago\" detail")
+ArgParser.add_argument("--driver", default="epd2in7", choices=["epd2in7", "epd2in7_V2"], help="Waveshare driver module: epd2in7 (Default) or epd2in7_V2 (has partial refresh)")
+ArgParser.add_argument("--full_refresh_every", type=int, default=10, help="Do a full (flashing) refresh every N panel updates, partial refreshes in between")
+ArgParser.add_argument("--sugarmate_url", help="Sugarmate API base URL (Default: https://sugarmate.io/api/v1 or $SUGARMATE_URL)")
 args=ArgParser.parse_args()
 
 if args.apikey != None:
@@ -44,6 +52,9 @@ if args.time_ago_interval != None:
 else:
     TIME_AGO_INTERVAL = 30
 
+if args.sugarmate_url != None:
+    Defaults.sugarmate_url = args.sugarmate_url.rstrip("/")
+
 #sys.path.append("./lib") #This assumes you have placed the waveshare_epd libraries in ./lib (subdirectory of where this file is)
 log.debug("The path is: " + str(Path(__file__).parent.absolute())+"/lib")
 sys.path.append(str(Path(__file__).parent.absolute())+"/lib")
@@ -52,48 +63,64 @@ _font_s = 20
 _font_m = 45
 _font_l = 75
 
-from waveshare_epd import epd2in7
+import importlib
+epd2in7 = importlib.import_module("waveshare_epd." + args.driver)
 from PIL import Image, ImageDraw, ImageFont
+from eink_panel import EinkPanel
 
 epd = epd2in7.EPD() # get the display
 epd.init()           # initialize the display
-epd.Clear(0xFF)      # clear the display
+try:
+    epd.Clear(0xFF)  # clear the display
+except TypeError:
+    epd.Clear()      # the V2 driver always clears to white
+panel = EinkPanel(epd, full_refresh_every=args.full_refresh_every)
+
+# Load the fonts once, not on every refresh
+font_s = ImageFont.truetype(font_file, _font_s)
+font_m = ImageFont.truetype(font_file, _font_m)
+font_l = ImageFont.truetype(font_file, _font_l)
 
-def printToDisplay(reading):
+Trends = TrendAnalyzer()
+REFRESH_STATS_INTERVAL = 3600
 
-    now = datetime.datetime.utcnow()
-    reading_time = datetime.datetime.utcfromtimestamp(reading["x"]) # Sugarmate puts the posix timstamp in the 'x' attribute
-    difference = round((now - reading_time).total_seconds()/60)
+def printToDisplay(reading, bgdelta):
+
+    difference = round(reading.age()/60)
     if difference == 0:
         str_difference = "Just Now"
     elif difference == 1:
         str_difference = str(difference) + " Minute Ago"
     else:
         str_difference = str(difference) + " Minutes Ago"
-    str_difference += "-"+reading["time"]
+    str_difference += "-"+datetime.datetime.fromtimestamp(reading.epoch).strftime("%H:%M")
 
     HBlackImage = Image.new('1', (epd2in7.EPD_HEIGHT, epd2in7.EPD_WIDTH), 255)
     draw = ImageDraw.Draw(HBlackImage) # Create draw object and pass in the image layer we want to work with (HBlackImage)
 
-    font_s = ImageFont.truetype(font_file, _font_s)
-    font_m = ImageFont.truetype(font_file, _font_m)
-    font_l = ImageFont.truetype(font_file, _font_l)
-
     draw.text((10, 5), str_difference, font = font_s, fill = 0)
-    draw.text((20, 40), str(reading["value"]) + reading["trend_symbol"], font = font_l, fill = 0)
-    draw.text((90, 120), reading["reading"].split()[2], font = font_m, fill = 0)
-    epd.display(epd.getbuffer(HBlackImage))
+    draw.text((20, 40), str(reading.mgdl) + reading.arrow, font = font_l, fill = 0)
+    draw.text((90, 120), format_delta(bgdelta), font = font_m, fill = 0)
+    panel.show(HBlackImage) # Skips the refresh entirely when the frame is unchanged
 
 i=0
+last_stats=time.monotonic()
 while True:
     i += 1
     try:
         log.info("Getting Reading from Sugarmate - Loop #" + str(i))
-        r=requests.get("https://sugarmate.io/api/v1/"+API_KEY+"/latest.json")
-        j=r.json()
-        printToDisplay(j)
+        url=Defaults.sugarmate_latest_url(API_KEY)
+        r=http_session.get_session(url).get(url)
+        j=normalize.sugarmate_reading(normalize.decode(r)) # Sugarmate puts the posix timstamp in the 'x' attribute
+        trend = Trends.add(j)
+        # Sugarmate's own delta until there's enough history for a fitted one
+        printToDisplay(j, trend.delta if trend.delta is not None else j.delta)
 
     except Exception as e:
+        metrics.fetch_failed("sugarmate")
         print("Exception processing The Reading, Sleeping and trying again....")
         print(e)
+    if time.monotonic() - last_stats >= REFRESH_STATS_INTERVAL:
+        last_stats = time.monotonic()
+        print("Panel refreshes: " + str(panel.refresh_stats()))
     time.sleep(CHECK_INTERVAL)
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""Waveshare e-Paper refresh policy: skip unchanged frames, prefer partial refreshes.
+
+A full e-ink refresh flashes the panel for seconds and wears it, so
+``EinkPanel.show`` hashes each composed frame and does nothing when it matches
+the one on the panel. Changed frames use the driver's partial refresh
+(``display_Partial``, e.g. epd2in7_V2) with a full refresh every
+``full_refresh_every`` updates to clear ghosting; drivers without partial
+refresh always get a full one. The panel sleeps between updates.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import time
+from typing import Any, Optional
+
+import metrics
+from logger import log
+
+REFRESH_METRIC = "cgm_eink_refreshes_total"
+metrics.registry.describe(REFRESH_METRIC, "counter", "e-ink panel refreshes (full, partial) and skipped identical frames")
+
+
+class EinkPanel:
+    def __init__(self, epd: Any, *, full_refresh_every: int = 10, sleep_between: bool = True) -> None:
+        self._epd = epd
+        self._full_refresh_every = max(1, full_refresh_every)
+        self._sleep_between = sleep_between
+        self._partial = getattr(epd, "display_Partial", None)
+        # display_Base also loads the partial-refresh base image where the driver has one.
+        self._full = getattr(epd, "display_Base", None) if self._partial else None
+        self._full = self._full or epd.display
+        self._frame_hash: Optional[bytes] = None
+        self._since_full = 0
+        self._asleep = False
+        self._started = time.monotonic()
+        self.full_refreshes = 0
+        self.partial_refreshes = 0
+        self.skipped = 0
+
+    @property
+    def supports_partial(self) -> bool:
+        return self._partial is not None
+
+    def show(self, image: Any) -> bool:
+        """Put a PIL image on the panel; False if it was identical to what's shown."""
+
+        frame_hash = hashlib.blake2b(image.tobytes(), digest_size=16).digest()
+        if frame_hash == self._frame_hash:
+            self.skipped += 1
+            metrics.registry.inc(REFRESH_METRIC, kind="skipped")
+            log.debug("Frame unchanged, not refreshing the panel")
+            return False
+
+        if self._asleep:
+            self._epd.init()
+            self._asleep = False
+        buffer = self._epd.getbuffer(image)
+        started = time.perf_counter()
+        if self._partial is not None and self._frame_hash is not None and self._since_full < self._full_refresh_every:
+            self._partial(buffer, 0, 0, self._epd.width, self._epd.height)
+            self._since_full += 1
+            self.partial_refreshes += 1
+            kind = "partial"
+        else:
+            self._full(buffer)
+            self._since_full = 0
+            self.full_refreshes += 1
+            kind = "full"
+        metrics.registry.inc(REFRESH_METRIC, kind=kind)
+        metrics.observe("display_update", time.perf_counter() - started)
+        self._frame_hash = frame_hash
+
+        if self._sleep_between:
+            self._epd.sleep()
+            self._asleep = True
+        return True
+
+    def refresh_stats(self) -> dict[str, float]:
+        """Counts so far, and full/partial refreshes per hour since start."""
+
+        hours = max(1 / 60, (time.monotonic() - self._started) / 3600)
+        return {
+            "full": self.full_refreshes,
+            "partial": self.partial_refreshes,
+            "skipped": self.skipped,
+            "full_per_hour": round(self.full_refreshes / hours, 1),
+            "partial_per_hour": round(self.partial_refreshes / hours, 1),
+        }
@@ -0,0 +1,140 @@
+"""Direct framebuffer output: write composed frames into an mmap'd fb device.
+
+SDL's fbdev driver is slow on the PiTFT and missing from many SDL2 builds, so
+instead pygame composes offscreen (dummy driver) and ``FramebufferOutput``
+converts the surface to the panel's native format (RGB565, or XRGB8888 on
+32-bit framebuffers) with numpy and copies only the rows that differ from the
+last frame into the memory-mapped device.
+
+Any regular file works in place of the device (it is grown to the frame size),
+which is how it is tested and benchmarked off the Pi.
+"""
+
+from __future__ import annotations
+
+import mmap
+import os
+from typing import Any, Iterable, Optional
+
+import numpy as np
+
+from logger import log
+
+
+def _sysfs_geometry(path: str) -> Optional[tuple[int, int, int, int]]:
+    """(width, height, bits per pixel, stride) of a /dev/fbN device; None for anything else."""
+
+    name = os.path.basename(os.path.realpath(path))
+    sysfs = os.path.join("/sys/class/graphics", name)
+    if not name.startswith("fb") or not os.path.isdir(sysfs):
+        return None
+
+    def read(attribute: str) -> str:
+        with open(os.path.join(sysfs, attribute), "r", encoding="ascii") as f:
+            return f.read().strip()
+
+    width, height = (int(v) for v in read("virtual_size").split(","))
+    bits_per_pixel = int(read("bits_per_pixel"))
+    stride = int(read("stride")) if os.path.exists(os.path.join(sysfs, "stride")) else width * bits_per_pixel // 8
+    return width, height, bits_per_pixel, stride
+
+
+def to_rgb565(rgb: np.ndarray) -> np.ndarray:
+    """(rows, cols, 3) uint8 RGB -> (rows, cols) uint16 RGB565."""
+
+    r = rgb[..., 0].astype(np.uint16)
+    g = rgb[..., 1].astype(np.uint16)
+    b = rgb[..., 2].astype(np.uint16)
+    return ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+
+
+def to_xrgb8888(rgb: np.ndarray) -> np.ndarray:
+    """(rows, cols, 3) uint8 RGB -> (rows, cols) uint32 XRGB8888."""
+
+    return (rgb[..., 0].astype(np.uint32) << 16) | (rgb[..., 1].astype(np.uint32) << 8) | rgb[..., 2]
+
+
+_FORMATS = {16: (np.uint16, to_rgb565), 32: (np.uint32, to_xrgb8888)}
+
+
+class FramebufferOutput:
+    def __init__(self, path: str = "/dev/fb1", size: tuple[int, int] = (480, 320), *, bits_per_pixel: int = 16) -> None:
+        geometry = _sysfs_geometry(path)
+        if geometry is None:
+            # A plain file standing in for the device.
+            width, height = size
+            stride = width * bits_per_pixel // 8
+        else:
+            width, height, bits_per_pixel, stride = geometry
+        if bits_per_pixel not in _FORMATS:
+            raise ValueError(f"Unsupported framebuffer depth: {bits_per_pixel} bits per pixel")
+        if size[0] > width or size[1] > height:
+            raise ValueError(f"Frames of {size[0]}x{size[1]} don't fit {path} ({width}x{height})")
+
+        dtype, self._convert = _FORMATS[bits_per_pixel]
+        self._path = path
+        self._size = size
+        length = stride * height
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if geometry is None and os.fstat(self._fd).st_size < length:
+            os.ftruncate(self._fd, length)
+        self._mmap = mmap.mmap(self._fd, length, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        pixels_per_row = stride // np.dtype(dtype).itemsize
+        self._pixels = np.ndarray((height, pixels_per_row), dtype=dtype, buffer=self._mmap)
+        # What we last wrote, to find the changed rows without reading device memory back.
+        self._shadow: Optional[np.ndarray] = None
+        self.frames = 0
+        self.rows_written = 0
+        log.info(f"Writing frames to {path}: {width}x{height}, {bits_per_pixel} bpp, stride {stride}")
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def write(self, pygame: Any, surface: Any, rects: Optional[Iterable[Any]] = None) -> int:
+        """Convert ``surface`` and copy its changed rows to the framebuffer; returns rows written.
+
+        ``rects`` (the dirty rectangles, if known) limits conversion to the rows they span.
+        """
+
+        width, height = self._size
+        top, bottom = 0, height
+        if rects is not None and self._shadow is not None:
+            rects = list(rects)
+            if not rects:
+                return 0
+            top = max(0, min(rect.top for rect in rects))
+            bottom = min(height, max(rect.bottom for rect in rects))
+            if top >= bottom:
+                return 0
+
+        pixels = pygame.surfarray.pixels3d(surface)
+        try:
+            frame = self._convert(pixels[:width, top:bottom].transpose(1, 0, 2))
+        finally:
+            del pixels  # releases the surface lock
+
+        if self._shadow is None:
+            self._shadow = frame
+            changed = np.arange(height)
+        else:
+            changed = np.flatnonzero((frame != self._shadow[top:bottom]).any(axis=1)) + top
+            self._shadow[top:bottom] = frame
+
+        # Copy each run of consecutive changed rows with one slice assignment.
+        if changed.size:
+            breaks = np.flatnonzero(np.diff(changed) != 1) + 1
+            for run in np.split(changed, breaks):
+                start, end = int(run[0]), int(run[-1]) + 1
+                self._pixels[start:end, :width] = frame[start - top:end - top]
+        self.frames += 1
+        self.rows_written += int(changed.size)
+        return int(changed.size)
+
+    def stats(self) -> dict[str, int]:
+        return {"frames": self.frames, "rows_written": self.rows_written}
+
+    def close(self) -> None:
+        self._pixels = None
+        self._mmap.close()
+        os.close(self._fd)
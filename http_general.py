@@ -1,6 +1,20 @@
-import requests
+import threading
+import time
 import urllib.parse
-from Defaults import Defaults
+import http_session
+import metrics
+from Defaults import Defaults, AuthError
+from logger import log
+from session_cache import SessionTokenCache
+
+MAX_AUTHFAILS = 1
+AUTH_RETRY_DELAY_BASE = 2
+# Dexcom answers an expired/unknown session with a 500 and one of these codes
+SESSION_ERROR_CODES = ("SessionNotValid", "SessionIdNotFound")
+
+token_cache = SessionTokenCache()
+_refreshing = set()
+_refreshing_lock = threading.Lock()
 
 def login_payload(opts):
     """ Build payload for the auth api query """
@@ -21,23 +35,23 @@ def authorize(opts):
             'Accept': Defaults.accept
             }
  
-    return requests.post(url, json=body, headers=headers)
+    return http_session.session_for(opts, url).post(url, json=body, headers=headers)
 
-def fetch_query(opts):
-    """ Build the api query for the data fetch
+def fetch_query(opts, minutes=1440, max_count=1):
+    """ Build the api query for the data fetch.  max_count > 1 backfills history
     """
     q = {
         "sessionID": opts.sessionID,
-        "minutes":  1440,
-        "maxCount": 1
+        "minutes":  minutes,
+        "maxCount": max_count
         }
     url = Defaults.LatestGlucose_url + '?' + urllib.parse.urlencode(q)
     return url
 
-def fetch(opts):
-    """ Fetch latest reading from dexcom share
+def fetch(opts, minutes=1440, max_count=1):
+    """ Fetch the latest reading (or the latest max_count readings) from dexcom share
     """
-    url = fetch_query(opts)
+    url = fetch_query(opts, minutes, max_count)
     body = {
             'applicationId': 'd89443d2-327c-4a6f-89e5-496bbb0317db'
             }
@@ -50,21 +64,61 @@ def fetch(opts):
             }
     #print(headers)
     #print(url)
-    return requests.post(url, json=body, headers=headers)
+    return http_session.session_for(opts, url).post(url, json=body, headers=headers)
 
-def get_sessionID(opts):
+def login(opts):
+    """ Log in to Dexcom share, retrying with backoff, and cache the new session ID """
     authfails = 0
-    while not opts.sessionID:
+    metrics.reauthed()
+    while True:
         res = authorize(opts)
         if res.status_code == 200:
-            opts.sessionID = res.text.strip('"')
-#            log.debug("Got auth token {}".format(opts.sessionID))
-        else:
-            if authfails > int(MAX_AUTHFAILS):
-                raise AuthError(res.status_code, res)
-            else:
-                log.warning("Auth failed with: {}".format(res.status_code))
-                time.sleep(AUTH_RETRY_DELAY_BASE**authfails)
-                authfails += 1
+            session_id = res.text.strip('"')
+            token_cache.store(opts.accountName, session_id)
+            return session_id
+        if authfails > int(MAX_AUTHFAILS):
+            raise AuthError(res.status_code, res)
+        log.warning("Auth failed with: {}".format(res.status_code))
+        time.sleep(AUTH_RETRY_DELAY_BASE**authfails)
+        authfails += 1
+
+def _refresh(opts):
+    try:
+        opts.sessionID = login(opts)
+        log.debug("Refreshed Dexcom session ahead of expiry")
+    except Exception as e:
+        log.warning("Background Dexcom session refresh failed: {!r}".format(e))
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(opts.accountName)
+
+def refresh_in_background(opts):
+    """ Start a login on a worker thread unless one is already running for this account """
+    with _refreshing_lock:
+        if opts.accountName in _refreshing:
+            return
+        _refreshing.add(opts.accountName)
+    threading.Thread(target=_refresh, args=(opts,), name="SessionRefresh", daemon=True).start()
+
+def get_sessionID(opts):
+    """ Return a usable session ID: in memory, then from the on-disk cache, logging in only as a last resort """
+    if not opts.sessionID:
+        opts.sessionID = token_cache.load(opts.accountName)
+        if opts.sessionID:
+            log.debug("Using cached Dexcom session")
+    if not opts.sessionID:
+        opts.sessionID = login(opts)
+    elif token_cache.needs_refresh(opts.accountName):
+        refresh_in_background(opts)
     return opts.sessionID
 
+def is_session_error(res):
+    """ True if a failed fetch means the session ID is no longer valid """
+    if res.status_code == 401:
+        return True
+    return res.status_code == 500 and any(code in res.text for code in SESSION_ERROR_CODES)
+
+def invalidate_session(opts):
+    """ Forget the session ID in memory and on disk so the next poll logs in again """
+    opts.sessionID = None
+    token_cache.invalidate(opts.accountName)
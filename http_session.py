@@ -0,0 +1,199 @@
+"""Shared keep-alive HTTP sessions for the CGM backends.
+
+Every backend (Dexcom Share, Nightscout, Sugarmate) goes through one long-lived
+``requests.Session`` per upstream host, so steady-state polls reuse an already
+open TCP/TLS connection instead of paying DNS, connect and handshake again.
+"""
+
+from __future__ import annotations
+
+import threading
+import urllib.parse
+from typing import Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import metrics
+from Defaults import Defaults
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self) -> None:
+        with metrics.timed("connect"):
+            super().connect()
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self) -> None:
+        # DNS, TCP and the TLS handshake.
+        with metrics.timed("connect"):
+            super().connect()
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedAdapter(HTTPAdapter):
+    """HTTPAdapter whose new connections record how long connecting took."""
+
+    def init_poolmanager(self, *args, **kwargs):  # type: ignore[override]
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+class PooledSession(requests.Session):
+    """A ``requests.Session`` with a bounded keep-alive pool and default timeouts."""
+
+    def __init__(
+        self,
+        *,
+        pool_maxsize: int = Defaults.pool_maxsize,
+        timeout: tuple[float, float] = (Defaults.connect_timeout, Defaults.read_timeout),
+    ) -> None:
+        super().__init__()
+        self.timeout = timeout
+        self._adapter = _TimedAdapter(pool_connections=1, pool_maxsize=pool_maxsize, pool_block=False)
+        self.mount("https://", self._adapter)
+        self.mount("http://", self._adapter)
+        self.headers["Connection"] = "keep-alive"
+
+    def request(self, method, url, *args, **kwargs):  # type: ignore[override]
+        kwargs.setdefault("timeout", self.timeout)
+        with metrics.timed("http"):
+            return super().request(method, url, *args, **kwargs)
+
+    def stats(self) -> dict[str, int]:
+        """Return request and connection counters for this session's pools."""
+
+        pools = self._adapter.poolmanager.pools
+        live = [pools[key] for key in pools.keys()]
+        requests_made = sum(pool.num_requests for pool in live)
+        new_connections = sum(pool.num_connections for pool in live)
+        return {
+            "requests": requests_made,
+            "new_connections": new_connections,
+            "reused_connections": max(0, requests_made - new_connections),
+        }
+
+
+_sessions: dict[str, PooledSession] = {}
+_sessions_lock = threading.Lock()
+
+
+def _host_key(url: str) -> str:
+    parts = urllib.parse.urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def get_session(url: str) -> PooledSession:
+    """Return the shared session for the host that ``url`` points at."""
+
+    key = _host_key(url)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = PooledSession()
+            _sessions[key] = session
+        return session
+
+
+def session_for(opts: Any, url: str) -> requests.Session:
+    """Use the session attached to ``opts`` if there is one, else the shared host session."""
+
+    session: Optional[requests.Session] = getattr(opts, "session", None)
+    return session if session is not None else get_session(url)
+
+
+def connection_stats() -> dict[str, dict[str, int]]:
+    """Per-host request, new-connection and reused-connection counters."""
+
+    with _sessions_lock:
+        return {host: session.stats() for host, session in _sessions.items()}
+
+
+def close_all() -> None:
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+class PollCache:
+    """Per-endpoint memory of the last poll, used to short-circuit unchanged responses.
+
+    Upstreams that send ``ETag``/``Last-Modified`` get conditional requests and
+    may answer 304. For those that don't, a byte-identical body is treated the
+    same way, and callers can also compare the (timestamp, value) identity of
+    the newest reading once it has been parsed.
+    """
+
+    def __init__(self) -> None:
+        self._validators: dict[str, dict[str, str]] = {}
+        self._bodies: dict[str, bytes] = {}
+        self._values: dict[str, Any] = {}
+        self._identities: dict[str, Any] = {}
+        self.polls = 0
+        self.not_modified = 0
+        self.unchanged_body = 0
+        self.unchanged_identity = 0
+
+    def headers(self, key: str) -> dict[str, str]:
+        """Conditional request headers for the endpoint, if it gave us validators."""
+
+        return dict(self._validators.get(key, {}))
+
+    def unchanged(self, key: str, response: requests.Response) -> bool:
+        """True when ``response`` carries nothing new and the cached value can be reused."""
+
+        self.polls += 1
+        if key not in self._values:
+            return False
+        if response.status_code == 304:
+            self.not_modified += 1
+            return True
+        if response.status_code < 400 and response.content == self._bodies.get(key):
+            self.unchanged_body += 1
+            return True
+        return False
+
+    def store(self, key: str, response: requests.Response, value: Any) -> None:
+        validators = {}
+        if response.headers.get("ETag"):
+            validators["If-None-Match"] = response.headers["ETag"]
+        if response.headers.get("Last-Modified"):
+            validators["If-Modified-Since"] = response.headers["Last-Modified"]
+        self._validators[key] = validators
+        self._bodies[key] = response.content
+        self._values[key] = value
+
+    def value(self, key: str) -> Any:
+        return self._values.get(key)
+
+    def same_identity(self, key: str, identity: Any) -> bool:
+        """Record the newest reading's identity; True if it matches the previous poll."""
+
+        same = key in self._identities and self._identities[key] == identity
+        self._identities[key] = identity
+        if same:
+            self.unchanged_identity += 1
+        return same
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "polls": self.polls,
+            "not_modified": self.not_modified,
+            "unchanged_body": self.unchanged_body,
+            "unchanged_identity": self.unchanged_identity,
+            "short_circuited": self.not_modified + self.unchanged_body + self.unchanged_identity,
+        }
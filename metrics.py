@@ -0,0 +1,208 @@
+"""Lightweight hot-path metrics with Prometheus text export.
+
+Each poll-to-frame stage (connect, HTTP, decode, normalize, render and the
+display update) is recorded into a fixed-bucket latency histogram, and fetch
+failures and Dexcom re-auths are counted. Recording costs two clock reads, a
+lock and a bisect, so it is always on. The metrics can be scraped from a
+local HTTP endpoint (``serve``) and/or written periodically to a file in the
+Prometheus text format (``write_periodically``, e.g. for node_exporter's
+textfile collector).
+"""
+
+from __future__ import annotations
+
+import bisect
+import http.server
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from logger import log
+
+# Seconds; covers a cached render (~0.1 ms) through a slow upstream (~10 s).
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+STAGE_METRIC = "cgm_stage_duration_seconds"
+
+
+def _labels(labels: tuple[tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self._bounds = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self) -> tuple[list[int], float]:
+        with self._lock:
+            return list(self._counts), self._sum
+
+    def exposition(self, name: str, labels: tuple[tuple[str, str], ...]) -> list[str]:
+        counts, total = self.snapshot()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self._bounds, counts):
+            cumulative += count
+            le = 'le="%s"' % bound
+            lines.append(f"{name}_bucket{_labels(labels, le)} {cumulative}")
+        cumulative += counts[-1]
+        le = 'le="+Inf"'
+        lines.append(f"{name}_bucket{_labels(labels, le)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {total}")
+        lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._histograms: dict[tuple[str, tuple], Histogram] = {}
+        self._counters: dict[tuple[str, tuple], float] = {}
+        self._help: dict[str, tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, kind: str, text: str) -> None:
+        self._help[name] = (kind, text)
+
+    def histogram(self, name: str, **labels: str) -> Histogram:
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram())
+        return histogram
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def counter(self, name: str, **labels: str) -> float:
+        return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def exposition(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        lines: list[str] = []
+        described = set()
+
+        def header(name: str, kind: str) -> None:
+            if name in described:
+                return
+            described.add(name)
+            help_kind, text = self._help.get(name, (kind, ""))
+            if text:
+                lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {help_kind}")
+
+        for (name, labels), histogram in histograms:
+            header(name, "histogram")
+            lines.extend(histogram.exposition(name, labels))
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+registry.describe(STAGE_METRIC, "histogram", "Time spent in each poll-to-frame stage")
+registry.describe("cgm_fetch_failures_total", "counter", "Failed upstream fetches")
+registry.describe("cgm_reauths_total", "counter", "Dexcom Share logins (no valid session, or it was rejected)")
+
+
+def observe(stage: str, seconds: float) -> None:
+    registry.histogram(STAGE_METRIC, stage=stage).observe(seconds)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+
+def fetch_failed(source: str) -> None:
+    registry.inc("cgm_fetch_failures_total", source=source)
+
+
+def reauthed() -> None:
+    registry.inc("cgm_reauths_total")
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = registry.exposition().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1") -> http.server.ThreadingHTTPServer:
+    """Serve /metrics on a daemon thread."""
+
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="MetricsServer", daemon=True).start()
+    log.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def write_file(path: str) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(registry.exposition())
+    os.replace(tmp_path, path)
+
+
+def write_periodically(path: str, interval: float = 60) -> threading.Thread:
+    """Rewrite ``path`` (atomically) with the current metrics every ``interval`` seconds."""
+
+    def run() -> None:
+        while True:
+            try:
+                write_file(path)
+            except OSError as e:
+                log.warning(f"Could not write metrics to {path}: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="MetricsWriter", daemon=True)
+    thread.start()
+    return thread
+
+
+def start_export(port: Optional[int] = None, path: Optional[str] = None, interval: float = 60) -> None:
+    """Start whichever exports were asked for; a failure to start one is logged, not fatal."""
+
+    if port:
+        try:
+            serve(int(port))
+        except OSError as e:
+            log.warning(f"Could not serve metrics on port {port}: {e}")
+    if path:
+        write_periodically(path, interval)
@@ -0,0 +1,81 @@
+"""asyncio front end for the Nightscout client.
+
+Runs the entries and devicestatus requests concurrently, each with its own
+timeout, so poll latency is the slower of the two round trips rather than their
+sum, and a slow devicestatus call can't hold back a new glucose value.
+
+The transport stays the pooled, synchronous ``Nightscout`` client (ring buffer,
+conditional requests and all); each request runs on a worker thread, which keeps
+the project free of a second HTTP stack. New entries are merged into the reading
+history back on the event loop, the only thread that touches it.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Any, Awaitable, Callable, Optional
+
+from Defaults import Defaults
+from nightscout_data import Nightscout
+
+
+class AsyncNightscout:
+    def __init__(
+        self,
+        nightscout: Nightscout,
+        *,
+        reading_timeout: float = Defaults.connect_timeout + Defaults.read_timeout,
+        devicestatus_timeout: float = Defaults.connect_timeout + Defaults.read_timeout,
+    ) -> None:
+        self._nightscout = nightscout
+        self._reading_timeout = reading_timeout
+        self._devicestatus_timeout = devicestatus_timeout
+        self._devicestatus_task: Optional[asyncio.Task] = None
+        # The worker-thread fetches themselves. A timeout only stops the wait, not
+        # the thread, so a fetch still running is joined rather than started again:
+        # the Nightscout client's ring buffer and poll cache aren't thread-safe.
+        self._fetches: dict[str, asyncio.Future] = {}
+
+    @property
+    def nightscout(self) -> Nightscout:
+        return self._nightscout
+
+    def _fetch(self, name: str, start: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        fetch = self._fetches.get(name)
+        if fetch is None or fetch.done():
+            fetch = self._fetches[name] = asyncio.ensure_future(start())
+            # Whoever timed out won't collect a late failure; mark it retrieved here.
+            fetch.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return fetch
+
+    async def _read_entries(self) -> Any:
+        fetched = await asyncio.to_thread(self._nightscout.fetchReadings)
+        # Shielded, so this still runs after a timed-out wait, but always on the loop.
+        return self._nightscout.mergeReadings(fetched)
+
+    async def getReading(self) -> Any:
+        fetch = self._fetch("entries", self._read_entries)
+        return await asyncio.wait_for(asyncio.shield(fetch), self._reading_timeout)
+
+    async def getDeviceStatus(self) -> Any:
+        fetch = self._fetch("devicestatus", lambda: asyncio.to_thread(self._nightscout.getDeviceStatus))
+        return await asyncio.wait_for(asyncio.shield(fetch), self._devicestatus_timeout)
+
+    def start_poll(self) -> tuple[asyncio.Task, asyncio.Task]:
+        """Start both requests; returns (entries task, devicestatus task).
+
+        A devicestatus request still in flight from an earlier poll is reused
+        rather than stacked behind a new one, and an entries fetch whose wait
+        timed out is joined rather than run twice at once.
+        """
+
+        reading_task = asyncio.create_task(self.getReading(), name="nightscout-entries")
+        if self._devicestatus_task is None or self._devicestatus_task.done():
+            self._devicestatus_task = asyncio.create_task(self.getDeviceStatus(), name="nightscout-devicestatus")
+        return reading_task, self._devicestatus_task
+
+    async def poll(self) -> tuple[Any, Any]:
+        """Fetch entries and devicestatus concurrently and wait for both."""
+
+        reading_task, devicestatus_task = self.start_poll()
+        return await asyncio.gather(reading_task, devicestatus_task)
@@ -1,19 +1,87 @@
-import requests
+import math
+import time
+
+import http_session
+import normalize
 from logger import log
+from readings import READING_INTERVAL, ReadingSeries
+
 
 class Nightscout:
-    def __init__(self, server) -> None:
+    def __init__(self, server, history_size=288) -> None:
         self._server = server
-        self._Readings_url = self._server + "/api/v1/entries/sgv?count=2"
+        self._Readings_url = self._server + "/api/v1/entries/sgv"
         self._DeviceStatus_url = self._server + "/api/v1/devicestatus"
         self._urlheaders = {'Accept': 'application/json'}
+        self._session = http_session.get_session(self._server)
+        self._polls = http_session.PollCache()
+        # Ring buffer of recent readings, oldest first.
+        self._history = ReadingSeries(history_size)
+
+    @property
+    def readings(self):
+        """ The local reading history (seed it before the first poll to only fetch what's missing) """
+        return self._history
+
+    def _entries_query(self):
+        """ Only ask for entries newer than the newest one we hold, bounded by the gap size """
+        newest = self._history.newest_epoch()
+        if newest is None:
+            return {"count": self._history.capacity}
+        gap = max(0, time.time() - newest)
+        count = min(self._history.capacity, math.ceil(gap / READING_INTERVAL) + 2)
+        return {"find[date][$gt]": round(newest * 1000), "count": count}
+
+    def add_readings(self, readings):
+        """ Merge readings that arrived some other way (e.g. the socket.io stream); returns how many were new """
+        return self._history.extend(readings)
+
+    def _get(self, key, url, **kwargs):
+        headers = {**self._urlheaders, **self._polls.headers(key)}
+        response = self._session.get(url, headers=headers, **kwargs)
+        if self._polls.unchanged(key, response):
+            return response, False
+        response.raise_for_status()
+        return response, True
 
     def getReading(self):
-        response = requests.get(self._Readings_url, headers=self._urlheaders)  # Get the last two readings
-        log.info(f"Got Status Code: {response.status_code}\nData: {response.text}")
-        return response.json()
+        return self.mergeReadings(self.fetchReadings())
+
+    def fetchReadings(self):
+        """ The network half of getReading: (response, new readings), or None if nothing changed
+
+        Only reads the newest reading time from the history, so it can run on a worker
+        thread while the history is in use; mergeReadings must then run where the history lives.
+        """
+        query = self._entries_query()
+        response, changed = self._get("entries", self._Readings_url, params=query)
+        if not changed:
+            return None
+        log.debug(f"Query: {query}\nData: {response.text}")
+        return response, normalize.nightscout_readings(normalize.decode(response))
+
+    def mergeReadings(self, fetched):
+        """ Merge what fetchReadings returned into the history; returns the history """
+        if fetched is not None:
+            response, readings = fetched
+            added = self._history.extend(readings)
+            self._polls.store("entries", response, added)
+            log.info(f"Got Status Code: {response.status_code}, {added} new entries ({len(self._history)} held)")
+        return self._history
 
     def getDeviceStatus(self):
-        devicestatus_response = requests.get(self._DeviceStatus_url, headers=self._urlheaders)
+        devicestatus_response, changed = self._get("devicestatus", self._DeviceStatus_url)
+        if not changed:
+            return self._polls.value("devicestatus")
         log.debug(f"DeviceStatus: {devicestatus_response.text}")
-        return devicestatus_response.json()
+        devicestatus = normalize.decode(devicestatus_response)
+        self._polls.store("devicestatus", devicestatus_response, devicestatus)
+        return devicestatus
+
+    def isNewReading(self, readings):
+        """ True unless the newest reading has the same (time, value) identity as on the last poll """
+        newest = readings.latest()
+        return not self._polls.same_identity("newest", newest.identity() if newest else None)
+
+    def poll_stats(self):
+        return self._polls.stats()
@@ -6,32 +6,31 @@ On Raspberry Pi (Linux/ARM), uses pygame to render to a PiTFT framebuffer.
 
 from __future__ import annotations
 
+import asyncio
 import datetime
 import logging
 import os
 import platform
-import sys
-from time import sleep
-from typing import Any, Optional
+from typing import Optional
 
+import http_session
+import metrics
+import normalize
 from Defaults import Defaults
 from cgm_args import cgm_args
 from logger import log
+from nightscout_async import AsyncNightscout
 from nightscout_data import Nightscout
+from nightscout_stream import STREAM_AVAILABLE, NightscoutStream
+from poll_scheduler import ReadingScheduler
 from pygame_display import PygameDisplay
+from reading_journal import ReadingJournal, open_journal
+from render_scheduler import RenderScheduler
+from readings import Reading, ReadingSeries, format_delta
+from trend_analysis import TrendAnalyzer
 
-def _epoch_to_utc_datetime(epoch: Any) -> datetime.datetime:
-    """Convert seconds-or-milliseconds epoch to an aware UTC datetime."""
-
-    try:
-        value = int(epoch)
-    except Exception:
-        value = int(str(epoch)[0:10])
-
-    # Nightscout "date" is commonly ms since epoch.
-    if value > 1_000_000_000_000:
-        value = value // 1000
-    return datetime.datetime.fromtimestamp(value, datetime.timezone.utc)
+def _newest_reading_epoch(readings: Optional[ReadingSeries]) -> Optional[float]:
+    return readings.newest_epoch() if readings else None
 
 
 def _format_time_ago(minutes: int) -> str:
@@ -42,25 +41,12 @@ def _format_time_ago(minutes: int) -> str:
     return f"{minutes} Minutes Ago"
 
 
-def _get_loop_image_path(devicestatus: Any, now_utc: datetime.datetime) -> Optional[str]:
-    if not devicestatus or not isinstance(devicestatus, list) or not devicestatus[0]:
-        log.info("No Loop Data, No Loop status Image Used")
-        return None
-
-    loop = devicestatus[0].get("loop")
-    if not loop or "timestamp" not in loop:
-        log.info("No Loop Data, No Loop status Image Used")
-        return None
-
-    try:
-        loop_time = datetime.datetime.strptime(loop["timestamp"], "%Y-%m-%dT%H:%M:%SZ").replace(
-            tzinfo=datetime.timezone.utc
-        )
-    except Exception:
+def _get_loop_image_path(loop_epoch: Optional[float], now_utc: datetime.datetime) -> Optional[str]:
+    if loop_epoch is None:
         log.info("No Loop Data, No Loop status Image Used")
         return None
 
-    loop_age_minutes = round((now_utc - loop_time).total_seconds() / 60)
+    loop_age_minutes = round((now_utc.timestamp() - loop_epoch) / 60)
     if 0 <= loop_age_minutes <= 5:
         loop_image = Defaults.Loop_Fresh
     elif 6 <= loop_age_minutes <= 10:
@@ -68,52 +54,39 @@ def _get_loop_image_path(devicestatus: Any, now_utc: datetime.datetime) -> Optio
     else:
         loop_image = Defaults.Loop_Stale
 
-    loop_image_path = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), loop_image)
+    loop_image_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), loop_image)
     log.info(f"Loop Age:{loop_age_minutes} Minutes, Loop Image Used:{loop_image_path}")
     return loop_image_path
 
 
 def display_reading(
-    readings: Any,
-    devicestatus: Any,
+    readings: Optional[ReadingSeries],
+    loop_epoch: Optional[float],
     *,
     display: Optional[PygameDisplay],
     connection_ok: bool,
-) -> Optional[dict[str, Any]]:
-    if not readings or not isinstance(readings, list) or len(readings) < 2:
+    trends: TrendAnalyzer,
+) -> Optional[Reading]:
+    if not readings or len(readings) < 2:
         log.warning("No readings (or not enough readings) returned from Nightscout")
         return None
 
-    reading = readings[0]
-    last_reading = readings[1]
-    if not isinstance(reading, dict) or not isinstance(last_reading, dict):
-        log.warning("Unexpected readings format returned from Nightscout")
-        return None
-
-    if "date" not in reading or "sgv" not in reading or "sgv" not in last_reading:
-        log.warning("Nightscout reading missing required fields")
-        return None
+    reading = readings.latest()
 
     now_utc = datetime.datetime.now(datetime.timezone.utc)
-    reading_time = _epoch_to_utc_datetime(reading["date"])
-    difference_minutes = round((now_utc - reading_time).total_seconds() / 60)
+    difference_minutes = round(reading.age(now_utc.timestamp()) / 60)
     str_difference = _format_time_ago(difference_minutes)
 
-    direction = reading.get("direction")
-    if direction in Defaults.DIRECTIONS:
-        trend_arrow = Defaults.ARROWS[str(Defaults.DIRECTIONS[direction])]
-    else:
-        trend_arrow = ""
-
     if difference_minutes < 7:
-        str_reading = f"{reading['sgv']}{trend_arrow}"
+        str_reading = f"{reading.mgdl}{reading.arrow}"
     else:
         str_reading = "---"
 
-    change_value = reading["sgv"] - last_reading["sgv"]
-    str_change = f"+{change_value}" if change_value > 0 else str(change_value)
+    trend = trends.update(readings)
+    str_change = format_delta(trend.delta)
+    log.debug(f"Trend: {trend.rate} mg/dL/min, 15 min: {trend.projected_15}, 30 min: {trend.projected_30}")
 
-    loop_image_path = _get_loop_image_path(devicestatus, now_utc)
+    loop_image_path = _get_loop_image_path(loop_epoch, now_utc)
 
     log.debug(f"Displaying:\n\t{str_difference}\n\t{str_reading}\n\t{str_change}")
     if display is None:
@@ -127,6 +100,7 @@ def display_reading(
             change=str_change,
             loop_image_path=loop_image_path,
             connection_ok=connection_ok,
+            history=readings,
         )
     except Exception as e:
         log.info("Caught an Exception processing the display")
@@ -146,65 +120,168 @@ def main() -> int:
     log.debug(f"Using Arguments: {args}")
 
     polling_interval = int(args.polling_interval)
-    time_ago_interval = int(args.time_ago_interval)
-    tick_interval = max(1, min(polling_interval, time_ago_interval))
 
     log.debug(f"Platform we're running on is: {platform.platform()}")
+    metrics.start_export(port=args.metrics_port, path=args.metrics_file)
 
     # Per user preference: always attempt pygame display initialization regardless of platform,
     # and fail fast if it can't initialize.
     try:
-        display = PygameDisplay()
+        display = PygameDisplay(
+            headless=args.headless,
+            frame_dir=args.frame_dir,
+            frame_format=args.frame_format,
+            framebuffer=args.framebuffer,
+        )
     except Exception as e:
         log.error("pygame not initialized; there will be no video device")
         log.error("Failed to initialize pygame display; exiting")
         log.error(e, exc_info=True)
         return 3
 
-    nightscout = Nightscout(args.night_scout_server)
+    client = Nightscout(args.night_scout_server)
+    trends = TrendAnalyzer()
+    journal = open_journal(args.night_scout_server, client.readings)
+    if len(client.readings) >= 2:
+        # Warm start: paint the last known reading before any network I/O.
+        display_reading(client.readings, None, display=display, connection_ok=False, trends=trends)
+    nightscout = AsyncNightscout(client)
+    # polling_interval is now the fallback/backoff ceiling; polls follow the reading cadence.
+    scheduler = ReadingScheduler(fallback_interval=polling_interval, max_backoff=polling_interval)
+    # Between polls, wake only when the on-screen text would change (not on a fixed tick).
+    renders = RenderScheduler()
+    stream = None
+    if args.stream is not None:
+        if STREAM_AVAILABLE:
+            stream = NightscoutStream(args.stream or args.night_scout_server, token=args.token, api_secret=args.api_secret)
+        else:
+            log.warning("python-socketio is not installed; polling Nightscout instead of streaming")
 
+    try:
+        return asyncio.run(_poll_loop(nightscout, scheduler, renders, display, journal, trends, stream))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        # engine.io's SIGINT handler cancels every task, so Ctrl-C can arrive as a cancellation.
+        log.info("Exiting on KeyboardInterrupt")
+        return 0
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+async def _poll_loop(
+    nightscout: AsyncNightscout,
+    scheduler: ReadingScheduler,
+    renders: RenderScheduler,
+    display: PygameDisplay,
+    journal: Optional[ReadingJournal],
+    trends: TrendAnalyzer,
+    stream: Optional[NightscoutStream] = None,
+) -> int:
     loop_count = 0
     last_fetch: Optional[datetime.datetime] = None
-    last_readings: Any = None
-    last_devicestatus: Any = None
+    # Readings loaded from the journal count as "last known" until the first fetch succeeds.
+    last_readings: Optional[ReadingSeries] = nightscout.nightscout.readings or None
+    # Devicestatus is normalized once when it arrives, not on every render.
+    last_loop_epoch: Optional[float] = None
     last_fetch_ok = False
+    devicestatus_task: Optional[asyncio.Task] = None
+    if stream is not None:
+        stream.start()
+    stream_task: Optional[asyncio.Task] = None
 
-    while True:
-        loop_count += 1
-        try:
-            now = datetime.datetime.now(datetime.timezone.utc)
-            should_fetch = last_fetch is None or (now - last_fetch).total_seconds() >= polling_interval
-            if should_fetch:
-                log.info(f"Getting Reading and Device Status from Nightscout - Loop #{loop_count}")
-                try:
-                    last_readings = nightscout.getReading()
-                    last_devicestatus = nightscout.getDeviceStatus()
-                    last_fetch = now
-                    last_fetch_ok = True
-                except Exception as e:
-                    last_fetch_ok = False
-                    # If we have never successfully fetched data, show a full-screen connection error.
-                    if last_fetch is None:
-                        log.error("Initial Nightscout connection failed")
+    try:
+        while True:
+            loop_count += 1
+            try:
+                now = datetime.datetime.now(datetime.timezone.utc)
+                streamed = False
+                if stream is not None:
+                    streamed_readings, streamed_loop_epoch = stream.take()
+                    if streamed_loop_epoch is not None:
+                        last_loop_epoch = streamed_loop_epoch
+                    if streamed_readings:
+                        added = nightscout.nightscout.add_readings(streamed_readings)
+                        log.info(f"Nightscout stream: {added} new entries")
+                        last_readings = nightscout.nightscout.readings
+                        if journal is not None:
+                            journal.sync(last_readings)
+                        last_fetch = now
+                        last_fetch_ok = True
+                        streamed = added > 0
+                # REST polling is the fallback: only poll while the stream is down.
+                should_fetch = scheduler.delay() <= 0 and not (stream is not None and stream.connected)
+                if should_fetch:
+                    log.info(f"Getting Reading and Device Status from Nightscout - Loop #{loop_count}")
+                    reading_task, devicestatus_task = nightscout.start_poll()
+                    try:
+                        last_readings = await reading_task
+                        if journal is not None:
+                            journal.sync(last_readings)
+                        last_fetch = now
+                        last_fetch_ok = True
+                        if not nightscout.nightscout.isNewReading(last_readings):
+                            log.info("Newest reading unchanged since last poll")
+                        log.debug(f"Poll stats: {nightscout.nightscout.poll_stats()}")
+                        log.debug(f"Connection stats: {http_session.connection_stats()}")
+                    except Exception as e:
+                        last_fetch_ok = False
+                        metrics.fetch_failed("nightscout")
+                        scheduler.observe(None)
+                        # If we have never had any data, show a full-screen connection error.
+                        if last_fetch is None and not last_readings:
+                            log.error("Initial Nightscout connection failed")
+                            log.error(e, exc_info=True)
+                            display.render_connection_error(detail=str(e))
+                            await asyncio.sleep(max(1.0, scheduler.delay()))
+                            continue
+
+                        # Otherwise, keep the last displayed reading and try again next poll.
+                        log.error("Nightscout fetch failed; keeping last known readings")
                         log.error(e, exc_info=True)
-                        display.render_connection_error(detail=str(e))
-                        sleep(tick_interval)
-                        continue
-
-                    # Otherwise, keep the last displayed reading and try again next poll.
-                    log.error("Nightscout fetch failed; keeping last known readings")
-                    log.error(e, exc_info=True)
-
-            display_reading(last_readings, last_devicestatus, display=display, connection_ok=last_fetch_ok)
-
-        except KeyboardInterrupt:
-            log.info("Exiting on KeyboardInterrupt")
-            return 0
-        except Exception as e:
-            log.error(e, exc_info=True)
-            log.info("Exception processing the reading, sleeping and trying again....")
 
-        sleep(tick_interval)
+                # Never wait on devicestatus here: render with whatever we have and pick it up when it lands.
+                if devicestatus_task is not None and devicestatus_task.done():
+                    try:
+                        last_loop_epoch = normalize.loop_epoch(devicestatus_task.result())
+                    except Exception as e:
+                        metrics.fetch_failed("nightscout_devicestatus")
+                        log.warning(f"Nightscout devicestatus fetch failed; keeping last loop status: {e!r}")
+                    devicestatus_task = None
+
+                display_reading(last_readings, last_loop_epoch, display=display, connection_ok=last_fetch_ok, trends=trends)
+                if (should_fetch or streamed) and last_fetch_ok:
+                    if scheduler.observe(_newest_reading_epoch(last_readings)):
+                        scheduler.log_stats()
+                        log.info(f"Render stats: {display.render_stats()}")
+
+            except Exception as e:
+                log.error(e, exc_info=True)
+                log.info("Exception processing the reading, sleeping and trying again....")
+
+            # Sleep until the next poll or the next visible change, but wake early to render a
+            # devicestatus that arrives late.
+            timeout = min(
+                max(1.0, scheduler.delay()),
+                renders.delay((_newest_reading_epoch(last_readings), last_loop_epoch)),
+            )
+            if stream is not None and stream.connected:
+                # Polling is off, so only the stream and the display clock wake us.
+                timeout = renders.delay((_newest_reading_epoch(last_readings), last_loop_epoch))
+            wakers = set() if devicestatus_task is None else {devicestatus_task}
+            if stream is not None:
+                # One wait task, reused until an update (or disconnect) completes it.
+                if stream_task is None or stream_task.done():
+                    stream_task = asyncio.create_task(stream.wait(), name="nightscout-stream-wait")
+                wakers.add(stream_task)
+            if wakers:
+                await asyncio.wait(wakers, timeout=timeout)
+            else:
+                await asyncio.sleep(timeout)
+    finally:
+        if stream_task is not None:
+            stream_task.cancel()
+        if stream is not None:
+            await stream.close()
 
 
 if __name__ == "__main__":
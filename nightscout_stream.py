@@ -0,0 +1,142 @@
+"""Live Nightscout updates over socket.io instead of REST polling.
+
+Nightscout pushes a ``dataUpdate`` event to authorized socket.io clients: the
+full recent history right after ``authorize``, then deltas (new sgvs,
+devicestatus rows) as they are uploaded. ``NightscoutStream`` keeps that
+connection up and queues the normalized readings and Loop time for the display
+loop, which renders as soon as an event lands and falls back to REST polling
+whenever the stream is down.
+
+python-socketio (with aiohttp) is optional; without it ``STREAM_AVAILABLE`` is
+False and the display just polls.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+from typing import Any, Optional
+
+import metrics
+import normalize
+from logger import log
+from readings import Reading
+
+try:
+    import socketio
+
+    STREAM_AVAILABLE = True
+except ImportError:
+    socketio = None
+    STREAM_AVAILABLE = False
+
+# Seconds between attempts to (re)establish the initial connection.
+RECONNECT_DELAYS = (1, 2, 5, 10, 30, 60)
+
+
+class NightscoutStream:
+    def __init__(
+        self,
+        url: str,
+        *,
+        token: Optional[str] = None,
+        api_secret: Optional[str] = None,
+        history_hours: int = 24,
+    ) -> None:
+        if not STREAM_AVAILABLE:
+            raise RuntimeError("Nightscout streaming needs python-socketio and aiohttp (pip install python-socketio aiohttp)")
+        self._url = url.rstrip("/")
+        self._authorize = {"client": "web", "history": history_hours}
+        if token:
+            self._authorize["token"] = token
+        if api_secret:
+            self._authorize["secret"] = hashlib.sha1(api_secret.encode("utf-8")).hexdigest()
+        self._client: Any = None
+        self._task: Optional[asyncio.Task] = None
+        self._updated: Optional[asyncio.Event] = None
+        self._readings: list[Reading] = []
+        self._loop_epoch: Optional[float] = None
+        self._authorized = False
+        self._closing = False
+        self.events = 0
+
+    @property
+    def connected(self) -> bool:
+        """True while authorized and receiving updates; poll over REST otherwise."""
+
+        return self._authorized and self._client is not None and self._client.connected
+
+    def start(self) -> None:
+        """Connect in the background (call from within the running event loop)."""
+
+        self._updated = asyncio.Event()
+        self._client = socketio.AsyncClient(reconnection=True, reconnection_delay_max=60, logger=False)
+        self._client.on("connect", self._on_connect)
+        self._client.on("disconnect", self._on_disconnect)
+        self._client.on("dataUpdate", self._on_data_update)
+        self._task = asyncio.create_task(self._connect(), name="nightscout-stream")
+
+    async def close(self) -> None:
+        self._closing = True
+        if self._task is not None:
+            self._task.cancel()
+        if self._client is not None:
+            await self._client.disconnect()
+
+    async def _connect(self) -> None:
+        # The client reconnects by itself once connected; this only retries the first connection.
+        attempt = 0
+        while True:
+            try:
+                await self._client.connect(self._url, transports=["websocket", "polling"])
+                return
+            except Exception as e:
+                delay = RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)]
+                attempt += 1
+                metrics.fetch_failed("nightscout_stream")
+                log.warning(f"Nightscout stream connection failed, polling instead and retrying in {delay}s: {e!r}")
+                await asyncio.sleep(delay)
+
+    async def _on_connect(self) -> None:
+        log.info(f"Nightscout stream connected to {self._url}; authorizing")
+        await self._client.emit("authorize", self._authorize, callback=self._on_authorized)
+
+    def _on_authorized(self, permissions: Any = None) -> None:
+        if isinstance(permissions, dict) and not permissions.get("read", True):
+            log.error("Nightscout stream is not authorized to read data; polling instead")
+            return
+        self._authorized = True
+        log.info("Nightscout stream authorized")
+
+    def _on_disconnect(self, *reason: Any) -> None:
+        self._authorized = False
+        if self._closing:
+            log.info("Nightscout stream closed")
+            return
+        log.warning("Nightscout stream disconnected; falling back to polling")
+        metrics.fetch_failed("nightscout_stream")
+        self._updated.set()
+
+    def _on_data_update(self, update: Any) -> None:
+        readings = normalize.nightscout_stream_readings(update)
+        loop_epoch = normalize.stream_loop_epoch(update)
+        # Some servers send dataUpdate before the authorize ack; data arriving means we can read.
+        self._authorized = True
+        self.events += 1
+        self._readings.extend(readings)
+        if loop_epoch is not None and (self._loop_epoch is None or loop_epoch > self._loop_epoch):
+            self._loop_epoch = loop_epoch
+        log.debug(f"Nightscout stream update: {len(readings)} sgvs, loop {loop_epoch}")
+        self._updated.set()
+
+    async def wait(self) -> None:
+        """Wait for the next update (or a disconnect)."""
+
+        await self._updated.wait()
+
+    def take(self) -> tuple[list[Reading], Optional[float]]:
+        """Readings received since the last call, and the newest Loop run seen so far."""
+
+        self._updated.clear()
+        readings, self._readings = self._readings, []
+        return readings, self._loop_epoch
@@ -0,0 +1,111 @@
+"""Decode upstream responses exactly once, straight into ``Reading`` objects.
+
+Each poll used to call ``res.json()`` several times and re-parse the same dicts
+on every render. Here a response body is decoded once (with orjson or msgspec
+when installed, the stdlib ``json`` module otherwise) and each source's payload
+is turned into readings in a single pass, so the rest of the code only ever
+sees the common reading structure.
+"""
+
+from __future__ import annotations
+
+import datetime
+import json
+from typing import Any, Optional
+
+import metrics
+from logger import log
+from readings import Reading
+
+try:
+    import orjson
+
+    loads = orjson.loads
+    DECODER = "orjson"
+except ImportError:
+    try:
+        import msgspec
+
+        loads = msgspec.json.decode
+        DECODER = "msgspec"
+    except ImportError:
+        loads = json.loads
+        DECODER = "json"
+
+
+def decode(response: Any) -> Any:
+    """Decode a response body (raises ValueError if it isn't JSON)."""
+
+    with metrics.timed("decode"):
+        return loads(response.content)
+
+
+def dexcom_readings(payload: Any) -> list[Reading]:
+    """ReadPublisherLatestGlucoseValues payload, newest first as Dexcom sends it."""
+
+    readings = []
+    with metrics.timed("normalize"):
+        for value in payload or ():
+            try:
+                readings.append(Reading.from_dexcom(value))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                log.debug(f"Skipping malformed Dexcom value: {value}")
+    return readings
+
+
+def nightscout_readings(payload: Any) -> list[Reading]:
+    """/api/v1/entries/sgv payload."""
+
+    readings = []
+    with metrics.timed("normalize"):
+        for entry in payload or ():
+            try:
+                readings.append(Reading.from_nightscout(entry))
+            except (KeyError, TypeError, ValueError):
+                log.debug(f"Skipping malformed entry: {entry}")
+    return readings
+
+
+def nightscout_stream_readings(update: Any) -> list[Reading]:
+    """The ``sgvs`` of a socket.io ``dataUpdate`` event (full or delta)."""
+
+    readings = []
+    with metrics.timed("normalize"):
+        for sgv in (update.get("sgvs") if isinstance(update, dict) else None) or ():
+            try:
+                readings.append(Reading.from_nightscout_stream(sgv))
+            except (KeyError, TypeError, ValueError):
+                log.debug(f"Skipping malformed sgv: {sgv}")
+    return readings
+
+
+def sugarmate_reading(payload: Any) -> Reading:
+    """Sugarmate latest.json payload."""
+
+    with metrics.timed("normalize"):
+        return Reading.from_sugarmate(payload)
+
+
+def loop_epoch(devicestatus: Any) -> Optional[float]:
+    """When Loop last ran, from an /api/v1/devicestatus payload; None if there's no Loop data."""
+
+    if not devicestatus or not isinstance(devicestatus, list) or not isinstance(devicestatus[0], dict):
+        return None
+    loop = devicestatus[0].get("loop")
+    if not isinstance(loop, dict) or not isinstance(loop.get("timestamp"), str):
+        return None
+    try:
+        loop_time = datetime.datetime.fromisoformat(loop["timestamp"].replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if loop_time.tzinfo is None:
+        loop_time = loop_time.replace(tzinfo=datetime.timezone.utc)
+    return loop_time.timestamp()
+
+
+def stream_loop_epoch(update: Any) -> Optional[float]:
+    """Newest Loop run in a ``dataUpdate`` event's devicestatus rows; None if it has none."""
+
+    rows = update.get("devicestatus") if isinstance(update, dict) else None
+    epochs = [loop_epoch([row]) for row in rows or ()]
+    return max((epoch for epoch in epochs if epoch is not None), default=None)
@@ -0,0 +1,127 @@
+"""Reading-cadence-aware poll scheduling.
+
+CGM transmitters produce a reading every ~5 minutes and the upstream services
+publish it shortly afterwards. Rather than polling on a fixed interval, the
+scheduler learns the arrival phase from the reading timestamps and the typical
+upload delay, polls just after the next reading should be available, and backs
+off exponentially while that reading is late. Every few readings the first poll
+goes out early, so the learned delay can shrink as well as grow (a poll at the
+expected time can only ever measure a delay at least that long).
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Optional
+
+from logger import log
+
+
+class ReadingScheduler:
+    def __init__(
+        self,
+        *,
+        cadence: float = 300.0,
+        fallback_interval: float = 60.0,
+        retry_interval: float = 15.0,
+        max_backoff: Optional[float] = None,
+        initial_delay: float = 20.0,
+        probe_every: int = 4,
+        min_probe_lead: float = 2.0,
+    ) -> None:
+        self._cadence = cadence
+        self._fallback_interval = fallback_interval
+        self._retry_interval = retry_interval
+        self._max_backoff = max_backoff if max_backoff is not None else fallback_interval
+        # Learned delay between the reading timestamp and it being fetchable upstream.
+        self._arrival_delay = initial_delay
+        self._last_reading: Optional[float] = None
+        self._last_poll: Optional[float] = None
+        self._misses = 0
+        # For every probe_every-th reading, poll _probe_lead seconds early. The lead
+        # doubles when the early poll finds the reading and halves when it doesn't.
+        self._probe_every = max(1, probe_every)
+        self._min_probe_lead = min_probe_lead
+        self._probe_lead = initial_delay / 2
+        self._probing = False
+
+        self.polls = 0
+        self.new_readings = 0
+        self.last_latency: Optional[float] = None
+        self.max_latency = 0.0
+        self._latency_total = 0.0
+
+    def observe(self, reading_epoch: Optional[float], seen_at: Optional[float] = None) -> bool:
+        """Record the newest reading time after a poll; returns True if it was new.
+
+        ``seen_at`` should be taken once the reading is on screen, so the
+        reported latency is reading-to-screen.
+        """
+
+        seen_at = time.time() if seen_at is None else seen_at
+        self.polls += 1
+        self._last_poll = seen_at
+        is_new = reading_epoch is not None and (self._last_reading is None or reading_epoch > self._last_reading)
+        if self._probing:
+            # This was the early poll.
+            self._probing = False
+            if is_new:
+                self._probe_lead = min(self._probe_lead * 2, self._arrival_delay / 2)
+            else:
+                self._probe_lead = max(self._probe_lead / 2, self._min_probe_lead)
+        if not is_new:
+            self._misses += 1
+            return False
+
+        latency = max(0.0, seen_at - reading_epoch)
+        if self._last_reading is not None and self._misses <= 1 and latency < self._cadence:
+            # Only learn from readings caught close to their arrival; a late catch over-estimates.
+            self._arrival_delay += 0.3 * (latency - self._arrival_delay)
+        self._last_reading = reading_epoch
+        self._misses = 0
+
+        self.new_readings += 1
+        self._probing = self.new_readings % self._probe_every == 0
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self._latency_total += latency
+        return True
+
+    def next_poll_at(self, now: Optional[float] = None) -> float:
+        now = time.time() if now is None else now
+        if self._last_reading is None or self._last_poll is None:
+            return now if self._last_poll is None else self._last_poll + self._fallback_interval
+
+        expected = self._last_reading + self._cadence + self._arrival_delay
+        if self._probing:
+            probe = expected - min(self._probe_lead, self._arrival_delay / 2)
+            if self._last_poll < probe:
+                return max(probe, now)
+        if self._last_poll < expected:
+            return max(expected, now)
+
+        if self._last_poll - self._last_reading > 3 * self._cadence:
+            # The upstream has gone quiet; no point chasing the phase.
+            return self._last_poll + self._fallback_interval
+
+        backoff = min(self._retry_interval * 2 ** max(0, self._misses - 1), self._max_backoff)
+        return self._last_poll + backoff
+
+    def delay(self, now: Optional[float] = None) -> float:
+        """Seconds to wait before the next poll."""
+
+        now = time.time() if now is None else now
+        return max(0.0, self.next_poll_at(now) - now)
+
+    def stats(self) -> dict[str, Optional[float]]:
+        return {
+            "polls": self.polls,
+            "new_readings": self.new_readings,
+            "arrival_delay": round(self._arrival_delay, 1),
+            "last_latency": self.last_latency,
+            "mean_latency": round(self._latency_total / self.new_readings, 1) if self.new_readings else None,
+            "max_latency": self.max_latency,
+        }
+
+    def log_stats(self) -> None:
+        log.info(f"Poll scheduler: {self.stats()}")
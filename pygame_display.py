@@ -10,10 +10,17 @@ import datetime
 import os
 import platform
 import sys
+import time
 from typing import Optional
 
+import metrics
 from Defaults import Defaults
+from asset_cache import AssetCache
+from framebuffer import FramebufferOutput
 from logger import log
+from readings import ReadingSeries
+from text_cache import TextCache
+from trend_graph import TrendGraph
 
 
 def _is_night_time() -> bool:
@@ -22,7 +29,7 @@ def _is_night_time() -> bool:
 
 
 def _nightscout_icon_path() -> str:
-    base_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
+    base_dir = os.path.dirname(os.path.abspath(__file__))
     return os.path.join(base_dir, "assets", "nightscout_large.png")
 
 
@@ -48,12 +55,47 @@ def _ensure_nightscout_icon_downloaded(dest_path: str) -> None:
         f.write(response.content)
 
 
+RAW_FRAME_SUFFIXES = (".rgb", ".raw")
+
+
+def save_surface(pygame, surface, path: str) -> None:
+    """Write a frame as raw 24-bit RGB for .rgb/.raw paths, otherwise as an image (PNG etc.) by extension."""
+
+    if path.lower().endswith(RAW_FRAME_SUFFIXES):
+        tobytes = getattr(pygame.image, "tobytes", None) or pygame.image.tostring
+        with open(path, "wb") as f:
+            f.write(tobytes(surface, "RGB"))
+    else:
+        pygame.image.save(surface, path)
+
+
+def _platform_font() -> str:
+    the_platform = platform.platform().lower()
+    if "linux" in the_platform:
+        return Defaults.Linux_font
+    if "macos" in the_platform:
+        return Defaults.Mac_font
+    return ""
+
+
 class PygameDisplay:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        *,
+        partial_updates: bool = True,
+        headless: bool = False,
+        frame_dir: Optional[str] = None,
+        frame_format: str = "png",
+        framebuffer: Optional[str] = None,
+    ) -> None:
         os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "hide"
-        # On Raspberry Pi targets, pygame typically renders to a framebuffer device.
-        # On desktop platforms, this is ignored and pygame opens a normal window.
-        if sys.platform.startswith("linux"):
+        if headless or framebuffer:
+            # Render offscreen (no window, no panel); frames can still be exported,
+            # or written straight to the framebuffer below.
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+        elif sys.platform.startswith("linux"):
+            # On Raspberry Pi targets, pygame typically renders to a framebuffer device.
+            # On desktop platforms, this is ignored and pygame opens a normal window.
             os.putenv("SDL_FBDEV", "/dev/fb1")  # May need adjustment for other framebuffer devices.
 
         import pygame  # local import: optional dependency
@@ -61,19 +103,43 @@ class PygameDisplay:
         self._pygame = pygame
         pygame.init()
         self._lcd = pygame.display.set_mode((480, 320))
-
-        self._nightscout_icon_base: Optional["pygame.Surface"] = None
-        self._connection_error_icon: Optional["pygame.Surface"] = None
+        self._framebuffer = FramebufferOutput(framebuffer, self._lcd.get_size()) if framebuffer else None
+        self._text = TextCache(pygame)
+        self._assets = AssetCache(pygame)
+        self._font_to_use = _platform_font()
+        self._trend = TrendGraph(pygame, (140, 70), text_cache=self._text)
+
+        # Dirty-rectangle state: what each screen region showed last frame and where.
+        self._partial_updates = partial_updates
+        self._last_theme: Optional[tuple] = None
+        self._last_regions: dict[str, tuple[object, Optional["pygame.Rect"]]] = {}
+        self._last_frame: Optional[tuple] = None
+        self.full_updates = 0
+        self.partial_updates = 0
+        self.skipped_frames = 0
+
+        # Per-frame render timing and optional export of every rendered frame.
+        self._headless = headless
+        self._frame_dir = frame_dir
+        self._frame_format = frame_format
+        if frame_dir:
+            os.makedirs(frame_dir, exist_ok=True)
+        self.frames_rendered = 0
+        self.last_render_time = 0.0
+        self._render_time_total = 0.0
+        self._render_time_max = 0.0
+
+        self._nightscout_icon_path: Optional[str] = None
         try:
             icon_path = _nightscout_icon_path()
             _ensure_nightscout_icon_downloaded(icon_path)
-            icon_surface = pygame.image.load(icon_path).convert_alpha()
-            self._nightscout_icon_base = icon_surface
-            self._connection_error_icon = pygame.transform.smoothscale(icon_surface, (96, 96))
+            # Load and pre-scale both sizes now so no frame pays for it.
+            self._assets.load(icon_path, (52, 52))
+            self._assets.load(icon_path, (96, 96))
+            self._nightscout_icon_path = icon_path
         except Exception:
             # If loading the PNG fails for any reason, we'll fall back to a drawn icon.
-            self._nightscout_icon_base = None
-            self._connection_error_icon = None
+            self._nightscout_icon_path = None
 
         log.debug("Initialized pygame display")
 
@@ -85,58 +151,76 @@ class PygameDisplay:
         change: str,
         loop_image_path: Optional[str],
         connection_ok: bool,
+        history: Optional[ReadingSeries] = None,
     ) -> None:
+        night = _is_night_time()
+        newest = history.newest_epoch() if history else None
+        frame = (difference, reading, change, loop_image_path, connection_ok, night, newest)
+        if frame == self._last_frame:
+            self.skipped_frames += 1
+            return
+        self._last_frame = frame
+        started = time.perf_counter()
+
         pygame = self._pygame
         lcd = self._lcd
         width, height = lcd.get_size()
+        text = self._text
+        # Each region maps to (content signature, screen rect) for the dirty-rect push.
+        regions: dict[str, tuple[object, Optional["pygame.Rect"]]] = {}
 
-        the_platform = platform.platform().lower()
-        if "linux" in the_platform:
-            font_to_use = Defaults.Linux_font
-        elif "macos" in the_platform:
-            font_to_use = Defaults.Mac_font
-        else:
-            font_to_use = ""
-
-        if _is_night_time():
-            lcd.fill(Defaults.BLACK)
+        if night:
+            background = Defaults.BLACK
             font_color = Defaults.GREY
+            guide_color = (70, 70, 70)
         else:
-            lcd.fill(Defaults.BLUE)
+            background = Defaults.BLUE
             font_color = Defaults.WHITE
+            guide_color = (120, 120, 255)
+        lcd.fill(background)
 
-        font_time = pygame.font.Font(None, 75)
-        time_surface = font_time.render(difference, True, font_color)
-        lcd.blit(time_surface, time_surface.get_rect(center=(240, 20)))
+        time_surface = text.render(difference, 75, font_color)
+        regions["time_ago"] = (difference, lcd.blit(time_surface, time_surface.get_rect(center=(240, 20))))
 
-        font_big = pygame.font.SysFont(font_to_use, 200)
-        reading_surface = font_big.render(reading, True, font_color)
-        lcd.blit(reading_surface, reading_surface.get_rect(center=(240, 155)))
+        reading_surface = text.render(reading, 200, font_color, face=self._font_to_use, sysfont=True)
+        regions["reading"] = (reading, lcd.blit(reading_surface, reading_surface.get_rect(center=(240, 155))))
 
-        font_medium = pygame.font.Font(None, 135)
-        change_surface = font_medium.render(change, True, font_color)
-        lcd.blit(change_surface, change_surface.get_rect(center=(240, 275)))
+        change_surface = text.render(change, 135, font_color)
+        regions["delta"] = (change, lcd.blit(change_surface, change_surface.get_rect(center=(240, 275))))
 
         if loop_image_path:
-            loop_surface = pygame.image.load(loop_image_path)
-            lcd.blit(loop_surface, loop_surface.get_rect(center=(450, 290)))
+            loop_surface = self._assets.load(loop_image_path)
+            regions["loop"] = (loop_image_path, lcd.blit(loop_surface, loop_surface.get_rect(center=(450, 290))))
+        else:
+            regions["loop"] = (None, None)
+
+        # Trend sparkline (bottom-left); the graph surface is updated incrementally.
+        trend_surface = None
+        if history:
+            trend_surface = self._trend.render(history, background=background, color=font_color, guide=guide_color)
+        if trend_surface is not None:
+            regions["trend"] = (newest, lcd.blit(trend_surface, (6, height - trend_surface.get_height() - 6)))
+        else:
+            regions["trend"] = (None, None)
 
         # Connection status badge (bottom-right): Nightscout icon + indicator.
-        if self._nightscout_icon_base is not None:
+        if self._nightscout_icon_path is not None:
             icon_size = 52
             margin = 8
-            icon = pygame.transform.smoothscale(self._nightscout_icon_base, (icon_size, icon_size))
+            icon = self._assets.load(self._nightscout_icon_path, (icon_size, icon_size))
             x = width - icon_size - margin
             y = height - icon_size - margin
-            lcd.blit(icon, (x, y))
+            badge = lcd.blit(icon, (x, y))
 
             indicator_r = 10
             indicator_center = (x + icon_size - 8, y + icon_size - 8)
             ok_color = (0, 200, 0)
             bad_color = (255, 80, 80)
             indicator_color = ok_color if connection_ok else bad_color
-            pygame.draw.circle(lcd, indicator_color, indicator_center, indicator_r)
+            # The indicator overhangs the icon; the region must cover both.
+            badge.union_ip(pygame.draw.circle(lcd, indicator_color, indicator_center, indicator_r))
             pygame.draw.circle(lcd, (255, 255, 255), indicator_center, indicator_r, 2)
+            regions["connection"] = (connection_ok, badge)
 
             if connection_ok:
                 cx, cy = indicator_center
@@ -152,22 +236,116 @@ class PygameDisplay:
                 pygame.draw.line(lcd, (255, 255, 255), (cx - 5, cy - 5), (cx + 5, cy + 5), 3)
                 pygame.draw.line(lcd, (255, 255, 255), (cx - 5, cy + 5), (cx + 5, cy - 5), 3)
 
-        pygame.display.update()
+        self._present((background, font_color), regions)
         pygame.mouse.set_visible(False)
+        self._frame_done(started)
+
+    def _present(self, theme: tuple, regions: dict[str, tuple[object, Optional["pygame.Rect"]]]) -> None:
+        """Push the composed frame, limited to the regions whose content changed.
+
+        The whole frame is always composed in memory (cheap with cached text);
+        only the framebuffer push is narrowed. Both the old and the new rect of
+        a changed region are pushed so shrinking text is erased too.
+        """
+
+        pygame = self._pygame
+        previous = self._last_regions
+        self._last_regions = regions
+
+        if not self._partial_updates or theme != self._last_theme or previous.keys() != regions.keys():
+            self._last_theme = theme
+            self.full_updates += 1
+            self._push()
+            return
+
+        dirty = []
+        for name, (signature, rect) in regions.items():
+            old_signature, old_rect = previous[name]
+            if signature == old_signature and rect == old_rect:
+                continue
+            dirty.extend(r for r in (old_rect, rect) if r is not None)
+
+        if dirty:
+            self.partial_updates += 1
+            self._push(dirty)
+
+    def _push(self, rects: Optional[list] = None) -> None:
+        """Show the composed frame (or just ``rects`` of it) on the display or framebuffer."""
+
+        with metrics.timed("display_update"):
+            if self._framebuffer is not None:
+                self._framebuffer.write(self._pygame, self._lcd, rects)
+            elif rects is None:
+                self._pygame.display.update()
+            else:
+                self._pygame.display.update(rects)
+
+    def _frame_done(self, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        self.frames_rendered += 1
+        self.last_render_time = elapsed
+        self._render_time_total += elapsed
+        self._render_time_max = max(self._render_time_max, elapsed)
+        metrics.observe("render", elapsed)
+        log.debug(f"Rendered frame {self.frames_rendered} in {elapsed * 1000:.2f} ms")
+        if self._frame_dir:
+            self.save_frame(os.path.join(self._frame_dir, f"frame-{self.frames_rendered:06d}.{self._frame_format}"))
+
+    def render_stats(self) -> dict[str, float]:
+        frames = self.frames_rendered
+        return {
+            "frames": frames,
+            "last_ms": self.last_render_time * 1000,
+            "mean_ms": self._render_time_total / frames * 1000 if frames else 0.0,
+            "max_ms": self._render_time_max * 1000,
+        }
+
+    @property
+    def headless(self) -> bool:
+        return self._headless
+
+    def save_frame(self, path: str) -> None:
+        """Write what is on screen now as PNG, or as raw RGB for a .rgb/.raw path."""
+
+        save_surface(self._pygame, self._lcd, path)
+
+    def frame_bytes(self) -> bytes:
+        """The current frame as a raw 24-bit RGB buffer (width * height * 3 bytes)."""
+
+        tobytes = getattr(self._pygame.image, "tobytes", None) or self._pygame.image.tostring
+        return tobytes(self._lcd, "RGB")
+
+    def text_cache_stats(self) -> dict[str, int]:
+        return self._text.stats()
+
+    def asset_cache_stats(self) -> dict[str, int]:
+        return self._assets.stats()
+
+    def framebuffer_stats(self) -> Optional[dict[str, int]]:
+        return self._framebuffer.stats() if self._framebuffer is not None else None
+
+    def trend_stats(self) -> dict[str, int]:
+        return {"rebuilds": self._trend.rebuilds, "scrolls": self._trend.scrolls}
 
     def render_connection_error(self, *, title: str = "Connection Error", detail: str = "") -> None:
         """Render a full-screen connection error message."""
 
+        started = time.perf_counter()
         pygame = self._pygame
         lcd = self._lcd
         width, height = lcd.get_size()
 
+        # A different layout is on screen now; the next render must push everything.
+        self._last_theme = None
+        self._last_regions = {}
+        self._last_frame = None
+
         lcd.fill(Defaults.BLUE)
         font_color = Defaults.WHITE
 
         # PNG icon preferred; fall back to a simple drawn icon.
-        if self._connection_error_icon is not None:
-            icon = self._connection_error_icon
+        if self._nightscout_icon_path is not None:
+            icon = self._assets.load(self._nightscout_icon_path, (96, 96))
             icon_pos = (int(width * 0.08), int(height * 0.14))
             lcd.blit(icon, icon_pos)
         else:
@@ -231,8 +409,8 @@ class PygameDisplay:
         text_right_margin = 18
         max_text_width = max(10, width - text_left - text_right_margin)
 
-        font_title = pygame.font.Font(None, 56)
-        font_detail = pygame.font.Font(None, 32)
+        font_title = self._text.font(56)
+        font_detail = self._text.font(32)
 
         title_lines = wrap_lines(title, font_title, max_text_width, max_lines=2)
         y = top_margin
@@ -256,5 +434,6 @@ class PygameDisplay:
                 lcd.blit(surf, (text_left, y))
                 y += surf.get_height() + 2
 
-        pygame.display.update()
+        self._push()
         pygame.mouse.set_visible(False)
+        self._frame_done(started)
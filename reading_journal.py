@@ -0,0 +1,182 @@
+"""Append-only on-disk journal of readings for instant warm start.
+
+Each reading is one fixed 16-byte record (epoch, mg/dL, trend, CRC32) after a
+small header. At startup the file is memory-mapped and scanned, so the last
+known reading and recent history can be painted before any network I/O. A
+record torn by a crash or power cut fails its CRC and is truncated away; the
+file is rewritten with only its newest half once it reaches ``max_records``.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import struct
+import zlib
+from typing import Optional
+
+from logger import log
+from readings import Reading, ReadingSeries
+from session_cache import cache_directory
+
+_MAGIC = b"CGMJ"
+_VERSION = 1
+_HEADER = struct.Struct("<4sHH8x")  # magic, version, record size
+_RECORD = struct.Struct("<dHbxI")  # epoch, mg/dL, trend, crc32 of the preceding bytes
+_PAYLOAD_SIZE = _RECORD.size - 4
+
+
+def journal_path(source: str) -> str:
+    """Default journal location for a data source (server URL or account name)."""
+
+    digest = hashlib.sha256(source.lower().encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_directory(), f"readings-{digest}.journal")
+
+
+def _pack(reading: Reading) -> bytes:
+    payload = _RECORD.pack(reading.epoch, max(0, min(0xFFFF, reading.mgdl)), reading.trend, 0)[:_PAYLOAD_SIZE]
+    return payload + struct.pack("<I", zlib.crc32(payload))
+
+
+class ReadingJournal:
+    def __init__(self, path: str, *, max_records: int = 4 * 7 * 24 * 12, fsync: bool = True) -> None:
+        self._path = path
+        self._max_records = max_records
+        self._fsync = fsync
+        self._fd: Optional[int] = None
+        self._count = 0
+        self._newest: Optional[float] = None
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def __len__(self) -> int:
+        return self._count
+
+    def open(self) -> list[Reading]:
+        """Open (creating if needed) and return every valid reading in the journal, oldest first."""
+
+        os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+        readings = self._scan()
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size == 0:
+            os.write(self._fd, _HEADER.pack(_MAGIC, _VERSION, _RECORD.size))
+        self._count = len(readings)
+        self._newest = readings[-1].epoch if readings else None
+        return readings
+
+    def _scan(self) -> list[Reading]:
+        try:
+            size = os.path.getsize(self._path)
+        except OSError:
+            return []
+        if size < _HEADER.size:
+            self._reset()
+            return []
+
+        readings: list[Reading] = []
+        with open(self._path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            magic, version, record_size = _HEADER.unpack_from(view, 0)
+            if magic != _MAGIC or version != _VERSION or record_size != _RECORD.size:
+                log.warning(f"Ignoring unrecognised reading journal {self._path}")
+                valid_end = None
+            else:
+                offset = _HEADER.size
+                while offset + _RECORD.size <= size:
+                    epoch, mgdl, trend, crc = _RECORD.unpack_from(view, offset)
+                    if zlib.crc32(view[offset:offset + _PAYLOAD_SIZE]) != crc:
+                        break
+                    readings.append(Reading(epoch, mgdl, trend))
+                    offset += _RECORD.size
+                valid_end = offset
+
+        if valid_end is None:
+            self._reset()
+            return []
+        if valid_end != size:
+            # A torn or corrupt tail from an interrupted append; drop it.
+            log.warning(f"Truncating {size - valid_end} bytes of damaged journal tail")
+            os.truncate(self._path, valid_end)
+        return readings
+
+    def _reset(self) -> None:
+        with open(self._path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, _RECORD.size))
+
+    def append(self, reading: Reading) -> bool:
+        """Durably append a reading newer than the newest journaled one."""
+
+        return self._write([reading]) == 1
+
+    def sync(self, series: ReadingSeries) -> int:
+        """Append everything in ``series`` newer than the journal; returns how many were written."""
+
+        fresh = series.since(self._newest) if self._newest is not None else list(series)
+        return self._write(fresh)
+
+    def _write(self, readings: list[Reading]) -> int:
+        """Append the readings newer than the journal with one write() and one fsync()."""
+
+        if self._fd is None:
+            raise RuntimeError("journal is not open")
+        records = []
+        newest = self._newest
+        for reading in readings:
+            if newest is not None and reading.epoch <= newest:
+                continue
+            records.append(_pack(reading))
+            newest = reading.epoch
+        if not records:
+            return 0
+        # Whole records on an O_APPEND fd; a crash mid-write leaves a CRC-failing tail.
+        os.write(self._fd, b"".join(records))
+        if self._fsync:
+            os.fsync(self._fd)
+        self._newest = newest
+        self._count += len(records)
+        if self._count >= self._max_records:
+            self._rotate()
+        return len(records)
+
+    def _rotate(self) -> None:
+        keep = self._max_records // 2
+        readings = self._scan()[-keep:]
+        tmp_path = self._path + ".tmp"
+        # Same owner-only permissions as the journal itself (a stale temp file would keep its own).
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, _RECORD.size))
+            f.write(b"".join(_pack(r) for r in readings))
+            f.flush()
+            os.fsync(f.fileno())
+        self.close()
+        os.replace(tmp_path, self._path)
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_APPEND, 0o600)
+        self._count = len(readings)
+        log.debug(f"Rotated reading journal, kept {self._count} readings")
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def open_journal(source: str, series: ReadingSeries, path: Optional[str] = None) -> Optional[ReadingJournal]:
+    """Open the journal for ``source`` and load its history into ``series``.
+
+    Returns None (and the display simply starts cold) if the journal can't be used.
+    """
+
+    journal = ReadingJournal(path or journal_path(source))
+    try:
+        loaded = series.extend(journal.open())
+    except (OSError, ValueError, struct.error) as e:
+        log.warning(f"Reading journal unavailable, starting without history: {e}")
+        return None
+    log.info(f"Loaded {loaded} readings from {journal.path}")
+    return journal
@@ -0,0 +1,230 @@
+"""Common reading type and compact reading history.
+
+Dexcom Share, Nightscout and Sugarmate each describe a glucose reading with a
+differently shaped dict. ``Reading`` is the one shape the display code works
+with, and ``ReadingSeries`` keeps days of history in three fixed-size typed
+arrays (about 11 bytes per reading), so memory stays flat however long the
+display runs.
+"""
+
+from __future__ import annotations
+
+import re
+import time
+from array import array
+from typing import Any, Iterator, Optional, Union
+
+from Defaults import Defaults
+
+READING_INTERVAL = 5 * 60  # Seconds between CGM readings
+
+_TREND_NAMES = {code: name for name, code in reversed(list(Defaults.DIRECTIONS.items()))}
+_DEXCOM_DATE = re.compile(r"\d+")
+
+
+def _trend_key(name: str) -> str:
+    # "NotComputable" (Dexcom), "NOT COMPUTABLE" (Nightscout) and "NOT_COMPUTABLE" (Sugarmate) all match.
+    return name.replace(" ", "").replace("_", "").lower()
+
+
+_TREND_CODES = {_trend_key(name): code for name, code in Defaults.DIRECTIONS.items()}
+
+
+def trend_code(direction: Any) -> int:
+    """Map a trend from any upstream (name, Sugarmate words or numeric code) to a Dexcom trend code."""
+
+    if isinstance(direction, int):
+        return direction if direction in _TREND_NAMES else 0
+    if not direction:
+        return 0
+    if direction in Defaults.DIRECTIONS:
+        return Defaults.DIRECTIONS[direction]
+    return _TREND_CODES.get(_trend_key(str(direction)), 0)
+
+
+def _epoch_seconds(value: Any) -> float:
+    value = float(value)
+    # Nightscout "date" is milliseconds since the epoch.
+    return value / 1000 if value > 1_000_000_000_000 else value
+
+
+def dexcom_epoch(st: str) -> float:
+    """Seconds since the epoch from a Dexcom "Date(1610000000000)" or "/Date(1610000000000-0500)/" stamp."""
+
+    start = st.find("(") + 1
+    end = start + 13
+    # Millisecond stamps are 13 digits until the year 2286; anything else takes the regex path.
+    if start and st[start:end].isdigit() and not st[end:end + 1].isdigit():
+        return int(st[start:end]) / 1000
+    return int(_DEXCOM_DATE.search(st).group()) / 1000
+
+
+def format_delta(delta: Optional[int]) -> str:
+    """Signed change for display; "--" when unknown."""
+
+    if delta is None:
+        return "--"
+    return f"+{delta}" if delta > 0 else str(delta)
+
+
+class Reading:
+    __slots__ = ("epoch", "mgdl", "trend", "delta")
+
+    def __init__(self, epoch: float, mgdl: int, trend: int = 0, delta: Optional[int] = None) -> None:
+        self.epoch = epoch
+        self.mgdl = mgdl
+        self.trend = trend
+        # Only set when the upstream supplies its own delta (Sugarmate).
+        self.delta = delta
+
+    @classmethod
+    def from_dexcom(cls, value: dict) -> "Reading":
+        """From one element of a ReadPublisherLatestGlucoseValues response."""
+
+        return cls(dexcom_epoch(value["ST"]), int(value["Value"]), trend_code(value.get("Trend")))
+
+    @classmethod
+    def from_nightscout(cls, entry: dict) -> "Reading":
+        """From one /api/v1/entries/sgv row."""
+
+        return cls(_epoch_seconds(entry["date"]), int(entry["sgv"]), trend_code(entry.get("direction")))
+
+    @classmethod
+    def from_nightscout_stream(cls, sgv: dict) -> "Reading":
+        """From one ``sgvs`` row of a Nightscout socket.io ``dataUpdate`` event."""
+
+        return cls(_epoch_seconds(sgv["mills"]), int(sgv["mgdl"]), trend_code(sgv.get("direction")))
+
+    @classmethod
+    def from_sugarmate(cls, latest: dict) -> "Reading":
+        """From a Sugarmate latest.json document."""
+
+        delta = latest.get("delta")
+        if delta is None:
+            parts = str(latest.get("reading", "")).split()
+            if len(parts) > 2:
+                try:
+                    delta = int(parts[2])
+                except ValueError:
+                    delta = None
+        return cls(_epoch_seconds(latest["x"]), int(latest["value"]), trend_code(latest.get("trend_words")), delta)
+
+    @property
+    def direction(self) -> str:
+        return _TREND_NAMES.get(self.trend, "nodir")
+
+    @property
+    def arrow(self) -> str:
+        # No arrow when the upstream gave no direction.
+        return Defaults.ARROWS.get(str(self.trend), "") if self.trend else ""
+
+    def age(self, now: Optional[float] = None) -> float:
+        """Seconds since the reading was taken."""
+
+        return (time.time() if now is None else now) - self.epoch
+
+    def identity(self) -> tuple[float, int]:
+        return (self.epoch, self.mgdl)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Reading):
+            return NotImplemented
+        return (self.epoch, self.mgdl, self.trend, self.delta) == (other.epoch, other.mgdl, other.trend, other.delta)
+
+    def __repr__(self) -> str:
+        return f"Reading(epoch={self.epoch}, mgdl={self.mgdl}, trend={self.direction})"
+
+
+class ReadingSeries:
+    """Fixed-capacity ring buffer of readings, oldest first, in parallel typed arrays.
+
+    Appends are O(1); indexing and slicing work like a list (negative indices
+    count from the newest reading). Only readings newer than the newest one
+    held are accepted, so the series is always in time order.
+    """
+
+    def __init__(self, capacity: int = 7 * 24 * 60 * 60 // READING_INTERVAL) -> None:
+        self._capacity = capacity
+        self._epoch = array("d", bytes(8 * capacity))
+        self._mgdl = array("H", bytes(2 * capacity))
+        self._trend = array("b", bytes(capacity))
+        self._start = 0
+        self._len = 0
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _slot(self, index: int) -> int:
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("reading index out of range")
+        return (self._start + index) % self._capacity
+
+    def _reading(self, slot: int) -> Reading:
+        return Reading(self._epoch[slot], self._mgdl[slot], self._trend[slot])
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Reading, list[Reading]]:
+        if isinstance(index, slice):
+            return [self._reading(self._slot(i)) for i in range(*index.indices(self._len))]
+        return self._reading(self._slot(index))
+
+    def __iter__(self) -> Iterator[Reading]:
+        for i in range(self._len):
+            yield self._reading((self._start + i) % self._capacity)
+
+    def append(self, reading: Reading) -> bool:
+        """Add a reading; returns False (and ignores it) unless it is newer than the newest held."""
+
+        if self._len and reading.epoch <= self._epoch[(self._start + self._len - 1) % self._capacity]:
+            return False
+        if self._len < self._capacity:
+            slot = (self._start + self._len) % self._capacity
+            self._len += 1
+        else:
+            slot = self._start
+            self._start = (self._start + 1) % self._capacity
+        self._epoch[slot] = reading.epoch
+        self._mgdl[slot] = max(0, min(0xFFFF, reading.mgdl))
+        self._trend[slot] = reading.trend
+        return True
+
+    def extend(self, readings: list[Reading]) -> int:
+        """Append readings in time order; returns how many were new."""
+
+        return sum(self.append(r) for r in sorted(readings, key=lambda r: r.epoch))
+
+    def latest(self) -> Optional[Reading]:
+        return self[-1] if self._len else None
+
+    def previous(self) -> Optional[Reading]:
+        return self[-2] if self._len > 1 else None
+
+    def newest_epoch(self) -> Optional[float]:
+        return self._epoch[(self._start + self._len - 1) % self._capacity] if self._len else None
+
+    def last(self, count: int) -> list[Reading]:
+        return self[max(0, self._len - count):]
+
+    def since(self, epoch: float) -> list[Reading]:
+        """Readings newer than ``epoch`` (binary search over the ring)."""
+
+        lo, hi = 0, self._len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._epoch[(self._start + mid) % self._capacity] <= epoch:
+                lo = mid + 1
+            else:
+                hi = mid
+        return self[lo:]
+
+    def delta(self) -> int:
+        """Change between the two most recent readings."""
+
+        if self._len < 2:
+            return 0
+        return self[-1].mgdl - self[-2].mgdl
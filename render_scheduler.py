@@ -0,0 +1,70 @@
+"""Wake the display only when something on screen will actually change.
+
+The "N Minutes Ago" text (and the stale "---" cutoff, which falls on one of
+those minute boundaries) can only change when a reading's rounded age in
+minutes ticks over, night mode only switches on the hour, and everything else
+changes only when new data arrives. ``RenderScheduler`` computes the next of
+those instants so the display loops can sleep until then instead of
+repainting on a fixed tick.
+"""
+
+from __future__ import annotations
+
+import datetime
+import math
+import time
+from typing import Iterable, Optional
+
+from Defaults import Defaults
+
+# Sleep this far past a boundary so the rounding has definitely flipped when we wake.
+_BOUNDARY_MARGIN = 0.05
+
+
+def next_minute_flip(epoch: float, now: float) -> float:
+    """When ``round(age / 60)`` of something timestamped ``epoch`` next changes.
+
+    The displayed age rounds to the nearest minute, so it flips at ages of
+    (k + 0.5) minutes.
+    """
+
+    age_minutes = (now - epoch) / 60
+    if age_minutes < -0.5:
+        return epoch - 30  # timestamp in the future (clock skew): first flip at age -0.5 min
+    return epoch + (math.floor(age_minutes + 0.5) + 0.5) * 60
+
+
+def next_night_switch(now: float, night_hours: Iterable[int] = Defaults.NIGHTMODE) -> Optional[float]:
+    """The next top of the hour where night mode turns on or off (local time)."""
+
+    night = {hour % 24 for hour in night_hours}
+    current = datetime.datetime.fromtimestamp(now)
+    hour_start = current.replace(minute=0, second=0, microsecond=0)
+    is_night = current.hour in night
+    for hours_ahead in range(1, 25):
+        candidate = hour_start + datetime.timedelta(hours=hours_ahead)
+        if (candidate.hour in night) != is_night:
+            return candidate.timestamp()
+    return None
+
+
+class RenderScheduler:
+    def __init__(self, *, night_hours: Iterable[int] = Defaults.NIGHTMODE, max_sleep: float = 3600.0) -> None:
+        self._night_hours = tuple(night_hours)
+        self._max_sleep = max_sleep
+
+    def next_change(self, epochs: Iterable[Optional[float]], now: Optional[float] = None) -> float:
+        """Earliest instant any displayed age (of the given timestamps) or the night mode changes."""
+
+        now = time.time() if now is None else now
+        candidates = [next_minute_flip(epoch, now) for epoch in epochs if epoch is not None]
+        night_switch = next_night_switch(now, self._night_hours)
+        if night_switch is not None:
+            candidates.append(night_switch)
+        return min(candidates, default=now + self._max_sleep)
+
+    def delay(self, epochs: Iterable[Optional[float]], now: Optional[float] = None) -> float:
+        """Seconds until the next visible change."""
+
+        now = time.time() if now is None else now
+        return min(self._max_sleep, max(0.0, self.next_change(epochs, now) - now + _BOUNDARY_MARGIN))
@@ -0,0 +1,88 @@
+"""On-disk cache of Dexcom Share session IDs.
+
+Logging in to Dexcom Share costs an extra round trip, and a fleet of displays
+restarting at once can trip the account lockout. Session IDs are therefore
+kept per account in small owner-only files with a TTL, so a restart reuses the
+last token and a normal poll never has to wait for a login.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import time
+from typing import Optional
+
+from Defaults import Defaults
+from logger import log
+
+
+def cache_directory() -> str:
+    """Where cgm_display keeps state between runs (overridable with CGM_DISPLAY_CACHE_DIR)."""
+
+    base = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.getenv("CGM_DISPLAY_CACHE_DIR") or os.path.join(base, "cgm_display")
+
+
+class SessionTokenCache:
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        *,
+        ttl: float = Defaults.session_ttl,
+        refresh_margin: float = Defaults.session_refresh_margin,
+    ) -> None:
+        self._directory = directory or cache_directory()
+        self._ttl = ttl
+        self._refresh_margin = refresh_margin
+
+    def _path(self, account_name: str) -> str:
+        # Don't put the account name itself in the file name.
+        digest = hashlib.sha256(account_name.lower().encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self._directory, f"dexcom-session-{digest}.json")
+
+    def _read(self, account_name: str) -> Optional[dict]:
+        try:
+            with open(self._path(account_name), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or not entry.get("sessionID") or "created" not in entry:
+            return None
+        return entry
+
+    def load(self, account_name: str) -> Optional[str]:
+        """Return the cached session ID if it is still inside its TTL."""
+
+        entry = self._read(account_name)
+        if entry is None or time.time() - entry["created"] >= self._ttl:
+            return None
+        return entry["sessionID"]
+
+    def needs_refresh(self, account_name: str) -> bool:
+        """True once a cached token is close enough to expiry to refresh it ahead of time."""
+
+        entry = self._read(account_name)
+        if entry is None:
+            # Nothing on disk to go by (e.g. the cache isn't writable); refresh reactively instead.
+            return False
+        return time.time() - entry["created"] >= self._ttl - self._refresh_margin
+
+    def store(self, account_name: str, session_id: str) -> None:
+        try:
+            os.makedirs(self._directory, mode=0o700, exist_ok=True)
+            path = self._path(account_name)
+            tmp_path = path + ".tmp"
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"sessionID": session_id, "created": time.time()}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.warning(f"Could not cache Dexcom session: {e}")
+
+    def invalidate(self, account_name: str) -> None:
+        try:
+            os.remove(self._path(account_name))
+        except OSError:
+            pass
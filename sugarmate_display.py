@@ -13,9 +13,14 @@ import logging
 import threading
 import urllib
 import urllib.parse #Python3 requires this
-import requests
+import http_session
 import json
+import metrics
+import normalize
 from Defaults import Defaults
+from readings import format_delta
+from text_cache import TextCache
+from trend_analysis import TrendAnalyzer
 
 #Process command line arguments
 ArgParser=argparse.ArgumentParser(description="Handle Command Line Arguments")
@@ -23,6 +28,7 @@ ArgParser.add_argument("--logging", '-l', default="INFO", help="Logging level: I
 ArgParser.add_argument("--apikey", '-a', help="Set your Sugarmate API Key (6 digit code from your Sugarmate Account)")
 ArgParser.add_argument("--polling_interval", help="Polling interval for getting updates from Sugarmate")
 ArgParser.add_argument("--time_ago_interval", help="Polling interval for updating the \"Time Ago\" detail")
+ArgParser.add_argument("--sugarmate_url", help="Sugarmate API base URL (Default: https://sugarmate.io/api/v1 or $SUGARMATE_URL)")
 args=ArgParser.parse_args()
 
 log = logging.getLogger(__file__)
@@ -49,13 +55,21 @@ if args.time_ago_interval != None:
 else:
     TIME_AGO_INTERVAL = 30
 
+if args.sugarmate_url != None:
+    Defaults.sugarmate_url = args.sugarmate_url.rstrip("/")
+
 if  platform.platform().find("arm") >= 0:
     os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
     import pygame
-    global pygame, lcd
+    global pygame, lcd, text_cache
     os.putenv('SDL_FBDEV', '/dev/fb1')
     pygame.init()
     lcd=pygame.display.set_mode((480, 320))
+    text_cache=TextCache(pygame)
+
+poll_cache = http_session.PollCache()
+Trends = TrendAnalyzer()
+LastFrame = None
 
 def isNightTime():
     now = datetime.datetime.now()
@@ -64,7 +78,7 @@ def isNightTime():
     else:
         return False
 
-def display_reading(reading):
+def display_reading(reading, bgdelta):
 
     if not platform.platform().find("arm") >= 0:
         log.debug("Skipping display.  Not on Raspberry Pi")
@@ -73,9 +87,7 @@ def display_reading(reading):
     log.debug("Getting ready to display on the LCD panel")
 
     log.debug("Displaying with Reading of " + str(reading))
-    now = datetime.datetime.utcnow()
-    reading_time = datetime.datetime.utcfromtimestamp(reading["x"]) # Sugarmate puts the posix timstamp in the 'x' attribute
-    difference = round((now - reading_time).total_seconds()/60)
+    difference = round(reading.age()/60)
     log.debug("Time difference since last good reading is: " + str(difference))
     #print("Time difference since last good reading is: " + str(difference))
     if difference == 0:
@@ -84,6 +96,12 @@ def display_reading(reading):
         str_difference = str(difference) + " Minute Ago"
     else:
         str_difference = str(difference) + " Minutes Ago"
+    global LastFrame
+    frame = (str_difference, reading.mgdl, reading.trend, bgdelta, isNightTime())
+    if frame == LastFrame:
+        log.debug("Nothing visible changed, skipping redraw")
+        return
+    LastFrame = frame
     log.info("About to update Time Ago Display with reading from " + str_difference)
 
     try:
@@ -97,31 +115,19 @@ def display_reading(reading):
            font_color=Defaults.WHITE
 
         log.debug("Setting up Difference Display")
-        font_time = pygame.font.Font(None, 75)
-        text_surface = font_time.render(str_difference, True, font_color)
+        text_surface = text_cache.render(str_difference, 75, font_color)
         rect = text_surface.get_rect(center=(240,20))
         lcd.blit(text_surface, rect)
 
         log.debug("Setting up Reading Display")
-        font_big = pygame.font.SysFont("dejavusans", 200)
 
-        if reading["trend_words"] == "DOUBLE_UP":
-            trend_arrow = chr(int("0x21D1",16))
-        elif reading["trend_words"] == "DOUBLE_DOWN":
-            trend_arrow = chr(int("0x21D3",16))
-        else:
-            trend_arrow = reading["reading"].split()[1]
-        str_reading = reading["reading"].split()[0] + trend_arrow
+        str_reading = str(reading.mgdl) + reading.arrow
         log.debug("About to push: " + str_reading + " to the display")
-        text_surface = font_big.render(str_reading, True, font_color)
+        text_surface = text_cache.render(str_reading, 200, font_color, face="dejavusans", sysfont=True)
         rect = text_surface.get_rect(center=(240,155))
         lcd.blit(text_surface, rect)
 
-        font_medium = pygame.font.Font(None, 135)
-        if len(reading["reading"].split()) > 2:
-            text_surface = font_medium.render(reading["reading"].split()[2],True,font_color)
-        else:
-            text_surface = font_medium.render("--",True,font_color)
+        text_surface = text_cache.render(format_delta(bgdelta), 135, font_color)
         rect = text_surface.get_rect(center=(240, 275))
         lcd.blit(text_surface, rect)
 
@@ -139,13 +145,25 @@ while True:
     i += 1
     try:
         log.info("Getting Reading from Sugarmate - Loop #" + str(i))
-        r=requests.get("https://sugarmate.io/api/v1/"+API_KEY+"/latest.json")
-        log.info("Got Status Code: " + str(r.status_code))
-        log.info("Data: " + str(r.json()))
-        j=r.json()
-        display_reading(j)
+        url=Defaults.sugarmate_latest_url(API_KEY)
+        r=http_session.get_session(url).get(url, headers=poll_cache.headers("latest"))
+        log.debug("Connection stats: " + str(http_session.connection_stats()))
+        if poll_cache.unchanged("latest", r):
+            log.debug("Sugarmate response unchanged since last poll, skipping parse")
+            j=poll_cache.value("latest")
+        else:
+            log.info("Got Status Code: " + str(r.status_code))
+            j=normalize.sugarmate_reading(normalize.decode(r)) # Sugarmate puts the posix timstamp in the 'x' attribute
+            poll_cache.store("latest", r, j)
+            if not poll_cache.same_identity("newest", j.identity()):
+                log.info("Data: " + r.text)
+        log.debug("Poll stats: " + str(poll_cache.stats()))
+        trend = Trends.add(j)
+        # Sugarmate's own delta until there's enough history for a fitted one
+        display_reading(j, trend.delta if trend.delta is not None else j.delta)
 
     except Exception as e:
+        metrics.fetch_failed("sugarmate")
         log.info("Exception processing The Reading, Sleeping and trying again....")
         log.info(e)
     sleep(CHECK_INTERVAL)
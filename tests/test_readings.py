@@ -0,0 +1,30 @@
+import unittest
+
+from readings import Reading, trend_code
+
+
+class TrendCodeTest(unittest.TestCase):
+    def test_upstream_spellings(self):
+        spellings = {
+            # Dexcom Share
+            "DoubleUp": 1, "FortyFiveUp": 3, "Flat": 4, "NotComputable": 8, "RateOutOfRange": 9,
+            # Nightscout
+            "SingleDown": 6, "NOT COMPUTABLE": 8, "RATE OUT OF RANGE": 9,
+            # Sugarmate trend_words
+            "DOUBLE_UP": 1, "FORTY_FIVE_UP": 3, "FLAT": 4, "DOUBLE_DOWN": 7, "NOT_COMPUTABLE": 8,
+            "RATE_OUT_OF_RANGE": 9,
+            # Numeric codes, and nothing
+            2: 2, 8: 8, 42: 0, None: 0, "": 0, "NONE": 0,
+        }
+        for direction, code in spellings.items():
+            with self.subTest(direction=direction):
+                self.assertEqual(trend_code(direction), code)
+
+    def test_uncomputable_trends_keep_their_arrow(self):
+        for direction in ("NotComputable", "RateOutOfRange", "NOT_COMPUTABLE", "RATE OUT OF RANGE"):
+            with self.subTest(direction=direction):
+                self.assertEqual(Reading(0.0, 100, trend_code(direction)).arrow, "??")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Font and rendered-text caching for the pygame displays.
+
+``pygame.font.SysFont`` scans the system font list on every call and
+``Font.render`` rasterizes glyphs from scratch, so both are kept out of the
+per-frame path: fonts are loaded once per (face, size) and rendered text
+surfaces are kept in a small LRU keyed by what they look like.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class TextCache:
+    def __init__(self, pygame: Any, maxsize: int = 64) -> None:
+        self._pygame = pygame
+        self._maxsize = maxsize
+        self._fonts: dict[tuple[Optional[str], int, bool], Any] = {}
+        self._surfaces: "OrderedDict[tuple, Any]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def font(self, size: int, face: Optional[str] = None, *, sysfont: bool = False) -> Any:
+        """Return a loaded font, loading it on first use only."""
+
+        key = (face, size, sysfont)
+        font = self._fonts.get(key)
+        if font is None:
+            if sysfont:
+                font = self._pygame.font.SysFont(face or "", size)
+            else:
+                font = self._pygame.font.Font(face, size)
+            self._fonts[key] = font
+        return font
+
+    def render(
+        self,
+        text: str,
+        size: int,
+        color: tuple[int, int, int],
+        *,
+        face: Optional[str] = None,
+        sysfont: bool = False,
+        antialias: bool = True,
+    ) -> Any:
+        """Return a rendered text surface, reusing a cached one when possible.
+
+        Cached surfaces are shared; callers must blit them, not draw onto them.
+        """
+
+        key = (text, face, size, sysfont, tuple(color), antialias)
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self._surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+
+        self.misses += 1
+        surface = self.font(size, face, sysfont=sysfont).render(text, antialias, color)
+        self._surfaces[key] = surface
+        if len(self._surfaces) > self._maxsize:
+            self._surfaces.popitem(last=False)
+        return surface
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "surfaces": len(self._surfaces),
+            "fonts": len(self._fonts),
+        }
+
+    def clear(self) -> None:
+        self._surfaces.clear()
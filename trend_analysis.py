@@ -0,0 +1,112 @@
+"""Rate of change and short-horizon projection from reading history.
+
+A two-point subtraction is wrong whenever a reading is missed (the "change"
+then spans ten or fifteen minutes) and jumps around with sensor noise.
+``TrendAnalyzer`` instead fits a time-weighted line through the recent
+readings, with weights halving every ``half_life`` seconds, and reports the
+slope in mg/dL per minute, a smoothed per-reading delta and 15/30-minute
+linear projections. Readings are fed in as they arrive and the fit is redone
+over a small fixed NumPy window only when something new came in.
+"""
+
+from __future__ import annotations
+
+from typing import Iterable, NamedTuple, Optional
+
+import numpy as np
+
+from readings import READING_INTERVAL, Reading, ReadingSeries
+
+# Dexcom reports "LOW"/"HIGH" outside this range, so projections are clipped to it.
+MIN_MGDL = 40
+MAX_MGDL = 400
+
+
+class Trend(NamedTuple):
+    rate: Optional[float]  # mg/dL per minute
+    delta: Optional[int]  # smoothed change per reading interval
+    projected_15: Optional[int]
+    projected_30: Optional[int]
+    points: int  # readings the fit used
+
+
+NO_TREND = Trend(None, None, None, None, 0)
+
+
+class TrendAnalyzer:
+    def __init__(self, *, window: float = 30 * 60, half_life: float = 10 * 60, capacity: int = 12) -> None:
+        self._window = window
+        self._half_life_minutes = half_life / 60
+        self._epochs = np.zeros(capacity)
+        self._values = np.zeros(capacity)
+        self._len = 0
+        self._trend = NO_TREND
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return self._len
+
+    def newest_epoch(self) -> Optional[float]:
+        return float(self._epochs[self._len - 1]) if self._len else None
+
+    def add(self, reading: Reading) -> Trend:
+        """Feed one reading; older-or-equal readings are ignored."""
+
+        newest = self.newest_epoch()
+        if newest is None or reading.epoch > newest:
+            if self._len == len(self._epochs):
+                self._epochs[:-1] = self._epochs[1:]
+                self._values[:-1] = self._values[1:]
+                self._len -= 1
+            self._epochs[self._len] = reading.epoch
+            self._values[self._len] = reading.mgdl
+            self._len += 1
+            self._dirty = True
+        return self.trend
+
+    def extend(self, readings: Iterable[Reading]) -> Trend:
+        for reading in readings:
+            self.add(reading)
+        return self.trend
+
+    def update(self, series: ReadingSeries) -> Trend:
+        """Feed whatever in ``series`` is newer than what has been seen so far."""
+
+        newest = self.newest_epoch()
+        fresh = series.last(len(self._epochs)) if newest is None else series.since(newest)
+        return self.extend(fresh)
+
+    @property
+    def trend(self) -> Trend:
+        if self._dirty:
+            self._trend = self._fit()
+            self._dirty = False
+        return self._trend
+
+    def _fit(self) -> Trend:
+        epochs = self._epochs[:self._len]
+        in_window = epochs[-1] - epochs <= self._window
+        # Minutes relative to the newest reading (all <= 0).
+        x = (epochs[in_window] - epochs[-1]) / 60
+        y = self._values[:self._len][in_window]
+        if len(x) < 2:
+            return Trend(None, None, None, None, len(x))
+
+        w = np.exp2(x / self._half_life_minutes)
+        x_mean = np.dot(w, x) / w.sum()
+        y_mean = np.dot(w, y) / w.sum()
+        dx = x - x_mean
+        spread = np.dot(w, dx * dx)
+        if spread <= 0:
+            return Trend(None, None, None, None, len(x))
+
+        rate = float(np.dot(w, dx * (y - y_mean)) / spread)
+        now = y_mean - rate * x_mean  # fitted value at the newest reading
+        projected = np.clip(now + rate * np.array([15.0, 30.0]), MIN_MGDL, MAX_MGDL)
+        return Trend(
+            rate,
+            round(rate * READING_INTERVAL / 60),
+            int(round(projected[0])),
+            int(round(projected[1])),
+            len(x),
+        )
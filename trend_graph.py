@@ -0,0 +1,171 @@
+"""Incrementally drawn glucose trend sparkline for the pygame display.
+
+The graph lives on its own cached surface. A new reading scrolls that surface
+left by one step and plots a single point, so drawing cost doesn't depend on
+how much history is shown; the whole graph is only rebuilt when its range,
+units, theme or size change (or history jumps in a way scrolling can't cover).
+"""
+
+from __future__ import annotations
+
+from typing import Any, Optional
+
+from readings import READING_INTERVAL, ReadingSeries
+
+MMOL_PER_MGDL = 1 / 18.0
+
+
+class TrendGraph:
+    def __init__(
+        self,
+        pygame: Any,
+        size: tuple[int, int] = (140, 70),
+        *,
+        hours: float = 3,
+        low: int = 70,
+        high: int = 180,
+        floor: int = 40,
+        ceiling: int = 300,
+        units: str = "mg/dL",
+        text_cache: Any = None,
+    ) -> None:
+        self._pygame = pygame
+        self._text = text_cache
+        self._size = size
+        self._hours = hours
+        self._units = units
+        self._low, self._high = low, high
+        self._floor, self._ceiling = floor, ceiling
+        self._surface: Optional[Any] = None
+        self._frame: Optional[Any] = None
+        self._labels: list[tuple[Any, tuple[int, int]]] = []
+        self._key: Optional[tuple] = None
+        self._last_epoch: Optional[float] = None
+        self._last_point: Optional[tuple[int, int]] = None
+        # Absolute column (see _column) of the surface's x = 0; keeps the guide dashes
+        # on the same grid as the surface scrolls.
+        self._origin = 0
+        self.rebuilds = 0
+        self.scrolls = 0
+
+    @property
+    def _step(self) -> float:
+        """Horizontal pixels per reading interval, so the plot spans exactly ``hours``."""
+
+        return (self._size[0] - 6) / (self._hours * 3600 / READING_INTERVAL)
+
+    def _column(self, epoch: float) -> int:
+        """Absolute pixel column of a reading time.
+
+        Rounding once per reading (rather than per step) keeps scroll shifts and
+        freshly plotted points on the same integer grid when a step isn't whole pixels.
+        """
+
+        return round(epoch / READING_INTERVAL * self._step)
+
+    def set_range(self, *, low: Optional[int] = None, high: Optional[int] = None,
+                  floor: Optional[int] = None, ceiling: Optional[int] = None) -> None:
+        self._low = self._low if low is None else low
+        self._high = self._high if high is None else high
+        self._floor = self._floor if floor is None else floor
+        self._ceiling = self._ceiling if ceiling is None else ceiling
+
+    def set_units(self, units: str) -> None:
+        self._units = units
+
+    def _y(self, mgdl: int) -> int:
+        height = self._size[1]
+        value = min(max(mgdl, self._floor), self._ceiling)
+        return round((height - 3) - (value - self._floor) * (height - 6) / (self._ceiling - self._floor))
+
+    def _label(self, mgdl: int) -> str:
+        return f"{mgdl * MMOL_PER_MGDL:.1f}" if self._units == "mmol/L" else str(mgdl)
+
+    def _paint_background(self, x: int, width: int, background: tuple, color: tuple) -> None:
+        """Background and target-range guide lines for the strip [x, x + width)."""
+
+        pygame = self._pygame
+        surface = self._surface
+        surface.fill(background, pygame.Rect(x, 0, width, self._size[1]))
+        for threshold in (self._low, self._high):
+            y = self._y(threshold)
+            start = x - (x + self._origin) % 6
+            for dash in range(start, x + width, 6):
+                left, right = max(dash, x), min(dash + 2, x + width - 1)
+                if left <= right:
+                    pygame.draw.line(surface, color, (left, y), (right, y))
+
+    def _plot(self, x: int, mgdl: int, color: tuple) -> None:
+        point = (x, self._y(mgdl))
+        if self._last_point is not None and 0 < point[0] - self._last_point[0] <= 2 * self._step + 1:
+            self._pygame.draw.line(self._surface, color, self._last_point, point, 2)
+        self._pygame.draw.circle(self._surface, color, point, 2)
+        self._last_point = point
+
+    def _rebuild(self, series: ReadingSeries, background: tuple, color: tuple, guide: tuple) -> None:
+        pygame = self._pygame
+        width, height = self._size
+        self._surface = pygame.Surface(self._size)
+        self._frame = pygame.Surface(self._size)
+        newest = series.newest_epoch()
+        right = width - 3
+        newest_column = self._column(newest)
+        self._origin = newest_column - right
+        self._paint_background(0, width, background, guide)
+        self._last_point = None
+        for reading in series.since(newest - self._hours * 3600 - 1):
+            self._plot(right - (newest_column - self._column(reading.epoch)), reading.mgdl, color)
+        # Threshold labels stay put while the plot scrolls, so they live outside the plot surface.
+        self._labels = []
+        if self._text is not None:
+            for threshold in (self._high, self._low):
+                label = self._text.render(self._label(threshold), 16, guide)
+                y = min(height - label.get_height(), max(0, self._y(threshold) - label.get_height()))
+                self._labels.append((label, (2, y)))
+        self._last_epoch = newest
+        self.rebuilds += 1
+
+    def render(self, series: ReadingSeries, *, background: tuple, color: tuple, guide: tuple) -> Optional[Any]:
+        """Return the graph surface for ``series``, updating the cached one in place."""
+
+        newest = series.newest_epoch()
+        if newest is None:
+            return None
+
+        key = (self._size, self._hours, self._units, self._low, self._high, self._floor, self._ceiling,
+               background, color, guide)
+        if self._surface is None or key != self._key:
+            self._key = key
+            self._rebuild(series, background, color, guide)
+            return self._compose()
+
+        if newest == self._last_epoch:
+            return self._frame
+
+        fresh = series.since(self._last_epoch)
+        steps = round((newest - self._last_epoch) / READING_INTERVAL)
+        newest_column = self._column(newest)
+        shift = newest_column - self._column(self._last_epoch)
+        if not fresh or shift <= 0 or shift >= self._size[0] or len(fresh) > steps:
+            self._rebuild(series, background, color, guide)
+            return self._compose()
+
+        # Scroll what's there and only draw the newly exposed strip.
+        width = self._size[0]
+        right = width - 3
+        self._surface.scroll(-shift, 0)
+        self._origin += shift
+        self._paint_background(width - shift, shift, background, guide)
+        if self._last_point is not None:
+            self._last_point = (self._last_point[0] - shift, self._last_point[1])
+        for reading in fresh:
+            self._plot(right - (newest_column - self._column(reading.epoch)), reading.mgdl, color)
+        self._last_epoch = newest
+        self.scrolls += 1
+        return self._compose()
+
+    def _compose(self) -> Any:
+        self._frame.blit(self._surface, (0, 0))
+        for label, position in self._labels:
+            self._frame.blit(label, position)
+        return self._frame